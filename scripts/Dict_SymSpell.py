@@ -1,44 +1,105 @@
-import csv
+"""
+Builds the SymSpell dictionary (dict_final.txt, "term count" per line) from
+checklist exports, reading them in chunks, and optionally the list of
+species (genus + epithet) used by matcher.Matcher:
+
+    python Dict_SymSpell.py dict_final.txt ThePlantList.csv --merge --species species.txt
+"""
+import argparse
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
 
-import numpy
 import pandas as pd
-import warnings
 
-warnings.filterwarnings("ignore")
-import spacy
+CHUNK_SIZE = 100000
+
+
+def count_words(names):
+    """(word counts, species) of a chunk of names."""
+    names = names.dropna().astype(str)
+    # the same cleaning as always: drop . & , ( ) and split on spaces
+    words = names.str.replace(r'[.&,()]', '', regex=True).str.split(' ').explode()
+    species = names.str.extract(r'^([A-Z][a-z-]+ [a-z-]+)(?: |$)')[0].dropna()
+    return Counter(words[words != ''].value_counts().to_dict()), set(species)
 
 
 class Dict:
 
-    def __init__(self, dict_name):
-        self.dic = []
+    def __init__(self, dict_name, column='species', processes=1):
+        self.dic = Counter()
+        self.species = set()
         self.dic_name = dict_name
-        self.nlp = spacy.write('en')
+        self.column = column
+        self.processes = processes
+
+    def chunks(self, planilha):
+        for chunk in pd.read_csv(planilha, usecols=[self.column], dtype=str, chunksize=CHUNK_SIZE):
+            yield chunk[self.column]
 
     def create_dict(self, planilha):
-        chars = ['.', '&', ',', ')', '(']
-        with open(planilha, mode='r') as csvfile:
-            lines = pd.read_csv(csvfile)
+        pool = Pool(self.processes) if self.processes > 1 else None
+        try:
+            counts = pool.imap(count_words, self.chunks(planilha)) if pool else map(count_words, self.chunks(planilha))
+            for i, (x, species) in enumerate(counts):
+                self.dic.update(x)
+                self.species.update(species)
+                print("%s: bloco %s, %s palavras" % (planilha, i + 1, len(self.dic)))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
 
-            # lines = csvfile.readlines()
-            for line in range(len(lines)):
-                split = lines["species"][line].translate(None, ''.join(chars)).split(" ")
-                self.dic = self.dic + split
-                print("%s %% \n" % (line*100/len(lines)))
+    def merge(self, dict_name=None):
+        """Adds the counts of an existing dictionary file (by default the output one)."""
+        path = Path(dict_name or self.dic_name)
+        if not path.exists():
+            return
+        with path.open('r', encoding='utf-8') as f:
+            for line in f:
+                x = line.rstrip('\n').rsplit(' ', 1)
+                if len(x) == 2 and x[0] and x[1].isdigit():
+                    self.dic[x[0]] += int(x[1])
+
+    def merge_species(self, file):
+        path = Path(file)
+        if path.exists():
+            with path.open('r', encoding='utf-8') as f:
+                self.species.update(line.strip() for line in f if line.strip())
+
+    def save_species(self, file):
+        temp = Path(str(file) + '.tmp')
+        with temp.open('w', encoding='utf-8') as f:
+            for x in sorted(self.species):
+                f.write("%s\n" % x)
+        temp.replace(file)
 
     def save_dict(self):
-        unique, counts = numpy.unique(self.dic, return_counts=True)
-        lista = zip(unique, counts)
-        with open(self.dic_name, 'w') as f:
-            for x in lista:
-                try:
-                    if x[0]:
-                        f.write("%s %s\n" % (x[0], x[1]))
-                except:
-                    print("err", x)
+        temp = Path(str(self.dic_name) + '.tmp')
+        with temp.open('w', encoding='utf-8') as f:
+            for x in sorted(self.dic.items()):
+                if x[0]:
+                    f.write("%s %s\n" % x)
+        temp.replace(self.dic_name)
 
 
 if __name__ == "__main__":
-    d = Dict("test.txt")
-    d.create_dict("ThePlantList.csv")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dict_name', help='dicionário gerado (ex.: dict_final.txt)')
+    parser.add_argument('planilhas', nargs='+', help='exportações em csv das checklists')
+    parser.add_argument('--column', default='species', help='coluna com os nomes')
+    parser.add_argument('--merge', action='store_true', help='soma às contagens do dicionário existente')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--species', default=None, help='lista de espécies gerada (ex.: species.txt)')
+    args = parser.parse_args()
+
+    d = Dict(args.dict_name, args.column, args.processes)
+    if args.merge:
+        d.merge()
+        if args.species:
+            d.merge_species(args.species)
+    for planilha in args.planilhas:
+        d.create_dict(planilha)
     d.save_dict()
+    if args.species:
+        d.save_species(args.species)
@@ -1,9 +1,11 @@
 import random
+from multiprocessing import freeze_support
 from tkinter import Tk
 
 from macrofitas_GUI import ThreadedClient
 
 if __name__ == '__main__':
+    freeze_support()
     rand = random.Random()
     root = Tk()
 
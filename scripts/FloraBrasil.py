@@ -5,78 +5,158 @@ from pathlib import Path
 from queue import Queue
 
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from requests import ReadTimeout
+from requests import RequestException
 
+import names
+from checklist import LocalNames
+from names import split_name
+from parsing import soup, strip_tags
 from project import Project
+from session import make_session
+from store import Index, Store, NEGATIVE_TTL
+from synonyms import Synonyms
 
+# the four requests of search(): name -> autocomplete -> identificador -> registro, nomeStr -> taxon
+STAGES = ('autocomplete', 'identificador', 'registro', 'taxon')
 
-class FloraBrasil:
-    def __init__(self, file="FloraBrasil_log.csv", path=Path('.')):
+
+class FloraBrasil(LocalNames):
+    source = 'flora'
+
+    def __init__(self, file="FloraBrasil_log.csv", path=Path('.'), session=None, workers=1, negative_ttl=NEGATIVE_TTL,
+                 checklist=None):
         self.result = None
+        # local copy of the checklist (checklist.Checklist): names found there skip the site
+        self.checklist = checklist
+        self.session = session or make_session(workers)
         self.path = path
         self.output = self.path / 'flora'
         self.output.mkdir(parents=True, exist_ok=True)
+        # names with the author: two homonyms are two taxa
+        self.index = Index(self.output, key=names.author_key)
+        self.negative = Store(self.output / 'index.db', 'negative')
+        self.negative_ttl = negative_ttl
+        # each request memoized on its own: synonyms often share the same id and taxon
+        self.stages = {x: Store(self.output / 'index.db', x) for x in STAGES}
+        # prefix -> autocomplete answer, shared by every name of the batch (and the next ones)
+        self.prefixes = Store(self.output / 'index.db', 'prefixo')
+        # synonym -> accepted name of every result written
+        self.synonyms = Synonyms(self.output / 'index.db')
+        self.synonyms.scan(self.index)
 
     def _get(self, query):
-        z = list(self.output.glob('**/*%s.csv' % query))
-        if len(z) > 0:
-            return pd.read_csv(z[0].open('r', encoding='utf-8'))
+        z = self.index.file(query)
+        if z:
+            return pd.read_csv(z.open('r', encoding='utf-8'))
 
-    def auto_complete(self, query):
-        text = query
+    def prefix(self, q, force=False):
+        x = None if force else self.prefixes.get(q, ttl=self.negative_ttl)
+        if x is None:
+            url = "http://floradobrasil.jbrj.gov.br/reflora/listaBrasil/ConsultaPublicaUC/BemVindoConsultaPublicaAutoCompleteNomeCompleto.do?&idGrupo=5&nomeCompleto=" + q
+            y = self.session.get(url, timeout=5)
+            # an error page is not an empty answer: HTTPError, and nothing is cached
+            y.raise_for_status()
+            x = json.loads(y.text)
+            self.prefixes.put(q, x)
+        return x
 
+    def auto_complete(self, query, force=False):
+        # The answer comes from the longest prefix of the query that has results:
+        # the name, if it is the only one. Results only shrink as the prefix grows,
+        # so once a prefix has exactly one that is the answer, and the longest
+        # prefix is found by a binary search over its length, starting at
+        # genus + epithet, instead of one request per character dropped.
+        lo, hi = 0, len(query) + 1
+        mid = len(' '.join(query.split(' ')[:2]))
         try:
-            while len(text) > 0:
-                q = query
-                q = q[0:-1]
-                url = "http://floradobrasil.jbrj.gov.br/reflora/listaBrasil/ConsultaPublicaUC/BemVindoConsultaPublicaAutoCompleteNomeCompleto.do?&idGrupo=5&nomeCompleto=" + q
-                y = requests.get(url, timeout=5)
-                x = json.loads(y.text)
+            while hi - lo > 1:
+                if not lo < mid < hi:
+                    mid = (lo + hi) // 2
+                x = self.prefix(query[:mid], force)
                 if len(x) == 1:
                     return x[0]
-                if len(x) > 1:
-                    break
-                text = text[:-1]
-        except:
+                if x:
+                    lo = mid
+                else:
+                    hi = mid
+                mid = (lo + hi) // 2
+        except ValueError:
             pass
 
-    def search(self, query):
+    def from_checklist(self, query, x):
+        taxon, accepted = x['taxon'], x['accepted']
+        return {'scientificname': taxon['name'], 'family': taxon['family'] or None, 'genus': taxon['genus'] or None,
+                'specificepithet': taxon['epithet'] or None, 'infraspecificepithet': taxon['infra'] or None,
+                'scientificnameauthorship': taxon['authorship'] or None, 'taxonomicstatus': taxon['status'],
+                'nomeStr': taxon['name'],
+                'acceptednameusage': accepted['name'] if accepted is not None and not taxon['accepted'] else None,
+                'SINONIMO': [{'scientificname': y} for y in x['synonyms']] if taxon['accepted'] else []}
+
+    def from_synonym(self, query, name, accepted):
+        genus, epithet, infra, authorship = split_name(name)
+        return {'scientificname': name, 'genus': genus, 'specificepithet': epithet or None,
+                'infraspecificepithet': infra.split(' ')[-1] if infra else None,
+                'scientificnameauthorship': authorship or None, 'taxonomicstatus': 'SINONIMO', 'nomeStr': name,
+                'acceptednameusage': accepted, 'SINONIMO': []}
+
+    def memo(self, stage, key, fetch, force=False):
+        if not key:
+            return None
+        if not force and key in self.stages[stage]:
+            return self.stages[stage].get(key)
+        value = fetch(key)
+        if value:
+            self.stages[stage].put(key, value)
+        return value
+
+    def search(self, query, force=False):
         if not query: return
-        z = self.auto_complete(query)
+        z = self.memo('autocomplete', query, lambda x: self.auto_complete(x, force), force)
         if not z:
             return None
-        y = self.get_identificador(z)
-        x = self.get_name_by_id(y)
+        y = self.memo('identificador', z, self.get_identificador, force)
+        x = self.memo('registro', y, self.get_name_by_id, force)
         if x and 'nomeStr' in x.keys():
             name = x['nomeStr']
         else:
             return None
-        url = self.get_specie_info_url(name)
-        result = requests.get(url, timeout=5)
-
-        specie_json = json.loads(result.text)
-        if not specie_json['result']:
+        result = self.memo('taxon', name, self.get_taxon, force)
+        if not result:
             return None
-        y = specie_json['result'][0]
+        y = dict(result[0])
         y.update(x)
         return y
 
+    def get_taxon(self, name):
+        url = self.get_specie_info_url(name)
+        result = self.session.get(url, timeout=5)
+        result.raise_for_status()
+        return json.loads(result.text)['result']
+
     def write(self, row, query):
         file = pd.DataFrame.from_dict(row)
-        file.to_csv(self.output / (query + '.csv'), index=False)
+        save_as = self.output / (names.filename(query, names.author_key) + '.csv')
+        file.to_csv(save_as, index=False)
+        self.index.add(query, save_as)
+        self.synonyms.add_record(row)
 
 
     def run(self, query, force=False):
         try:
-            if not force and len(list(self.output.glob('**/*%s.csv' % query))) > 0:
+            # file() and not `in`: a result whose file was deleted is downloaded again
+            if not force and self.index.file(query):
                 print('[Flora log]: %s' % query)
                 return
-            i = self.search(query)
+            if not force and self.negative.get(names.author_key(query), ttl=self.negative_ttl):
+                print('[Flora log]: %s não encontrado' % query)
+                return
+            i = self.local(query) or self.known(query) or self.search(query, force)
             if not i:
                 assss = Project()
-                i = self.search(assss.correct_name(query))
+                corrected = assss.correct_name(query)
+                i = self.local(corrected) or self.known(corrected) or self.search(corrected, force)
+                if not i:
+                    self.negative.put(names.author_key(query), {'corrected': corrected})
             if i:
                 out = {'Nome Entrada': [query], 'family': [None], 'genus': [None], 'scientificname': [None],
                        'specificepithet': [None],
@@ -96,36 +176,36 @@ class FloraBrasil:
                 for j in i.keys():
                     if j in out.keys():
                         out.update({j: [i[j]]})
-                out.update({'species': [i['nomeStr'][:i['nomeStr'].index(i['scientificnameauthorship'])]]})
+                author = i.get('scientificnameauthorship')
+                species = i['nomeStr'][:i['nomeStr'].index(author)] if author and author in i['nomeStr'] else i['nomeStr']
+                out.update({'species': [species]})
 
                 if out:
                     self.write(out, query)
+                    self.negative.remove(names.author_key(query))
                     print('[flora download]: %s' % query)
-        except ReadTimeout as e:
-            print(e)
-        except ConnectionError as e:
+        except RequestException as e:
             print(e)
 
     def get_name_by_id(self, id):
         try:
             if not id:
                 return None
-            response = requests.get(
+            response = self.session.get(
                 'http://floradobrasil.jbrj.gov.br/reflora/listaBrasil/ConsultaPublicaUC/ResultadoDaConsultaCarregaTaxonGrupo.do?&idDadosListaBrasil=' + id,
                 timeout=5)
+            response.raise_for_status()
             a = json.loads(response.text)
             j = {}
             for x in a.keys():
                 if type(a[x]) is not bool and a[x] is not None and a[x] != [] and a[x] != '':
                     text = a[x]
                     if x == 'bibliografiaFixa':
-                        text = BeautifulSoup(text, features="html.parser").text
+                        text = strip_tags(text)
                     j.update({x: text})
 
             return j
-        except ReadTimeout as e:
-            print(e)
-        except ConnectionError as e:
+        except ValueError as e:
             print(e)
 
     def get_identificador(self, query):
@@ -162,16 +242,15 @@ class FloraBrasil:
                 ('contexto', 'consulta-publica'),
             )
 
-            response = requests.get(
+            response = self.session.get(
                 'http://floradobrasil.jbrj.gov.br/reflora/listaBrasil/ConsultaPublicaUC/BemVindoConsultaPublicaConsultar.do',
                 params=params, timeout=5)
-            x = BeautifulSoup(response.text, features="html.parser")
+            response.raise_for_status()
+            x = soup(response.text, id='carregaTaxonGrupoIdDadosListaBrasil')
             a = x.select_one("#carregaTaxonGrupoIdDadosListaBrasil")
             if a:
                 return a['value']
-        except ReadTimeout as e:
-            print(e)
-        except ConnectionError as e:
+        except ValueError as e:
             print(e)
 
     def get_specie_info_url(self, specie):
@@ -1,105 +1,149 @@
-import json
+from itertools import chain
 from pathlib import Path
 
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+from requests import RequestException
 
+import names
+from occurrences import OccurrenceStore, fetch_pages, to_frame, write_csv
+from parsing import loads
 from project import Project
+from session import make_session
+from store import Index, Store, NEGATIVE_TTL
+
+# occurrence pages of one species fetched at the same time
+FANOUT = 4
+
+PARAMETROS = ['scientificName', 'country', 'specificEpithet', 'decimalLatitude', 'decimalLongitude', 'month', 'year',
+              'datasetName', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species', 'recordedBy']
+
+# what is kept of an occurrence search page: the count and PARAMETROS of each result
+PAGE = frozenset(['count', 'results'] + PARAMETROS)
 
 
 class GBIF:
 
-    def __init__(self, file='GBIF_log.csv', path=Path('.')):
+    def __init__(self, file='GBIF_log.csv', path=Path('.'), storage='csv', session=None, workers=1,
+                 negative_ttl=NEGATIVE_TTL, fanout=FANOUT, max_records=None):
         self.file_name = file
+        self.session = session or make_session(workers * fanout)
+        self.fanout = fanout
+        self.max_records = max_records
 
         self.path = path
         self.output = self.path / 'Gbif'
         self.output.mkdir(parents=True, exist_ok=True)
+        self.index = Index(self.output)
+        self.negative = Store(self.output / 'index.db', 'negative')
+        self.negative_ttl = negative_ttl
+        self.store = OccurrenceStore(self.path, 'gbif') if storage == 'parquet' else None
+
+    def _has(self, query):
+        if self.store:
+            return names.key(query) in self.store
+        # a result whose file was deleted is downloaded again
+        return self.index.file(query) is not None
 
     def _get(self, query):
-        z = list(self.output.glob('**/*%s.csv' % query))
-        if len(z) > 0:
-            return pd.read_csv(z[0].open('r', encoding='utf-8'))
+        if self.store:
+            return self.store.read(names.key(query))
+        z = self.index.file(query)
+        if z:
+            return pd.read_csv(z.open('r', encoding='utf-8'))
 
     def search(self, plant):
         if not plant: return
         params = [('q', plant), ('locale', 'en')]
         try:
-            response = requests.get('https://www.gbif.org/api/omnisearch', headers=None, params=params, timeout=20)
-            soup = BeautifulSoup(response._content, features="html.parser")
-
-            a = json.loads(soup.text)
+            response = self.session.get('https://www.gbif.org/api/omnisearch', headers=None, params=params, timeout=20)
+            # a 5xx/429 page is a network error, not a name that was not found
+            response.raise_for_status()
+            a = loads(response.content)
 
             if a["speciesMatches"]:
                 return a["speciesMatches"]["results"]
+        except RequestException:
+            raise
         except:
             print("Planta? %s" % plant)
 
-    def occurrence(self, result):
-
-        url = "https://www.gbif.org/api/occurrence/search"
+    def page(self, key, offset=0, limit=300):
+        params = [
+            ("country", "BR"), ("taxon_key", key,), ("offset", offset), ("limit", limit)
+        ]
+        response = self.session.get("https://www.gbif.org/api/occurrence/search", params=params, timeout=20)
+        response.raise_for_status()
+        return loads(response.content, PAGE)
+
+    def count(self, key):
+        # limit=0 only counts, so species without records in Brazil cost one small request
+        count = self.page(key, 0, 0)["count"]
+        if self.max_records is not None:
+            count = min(count, self.max_records)
+        return count
+
+    def pages(self, x, count, limit=300):
+        # every offset is known once we have the count: at most `fanout` pages are
+        # in flight, and they are given back in order
+        fetch = lambda offset: self.page(x["usageKey"], offset, min(limit, count - offset))
+        for offset, a in fetch_pages(fetch, range(0, count, limit), self.fanout):
+            print("GBIF: %s ...%s/%s" % (x['scientificName'], min(offset + limit, count), count))
+            yield a["results"]
+
+    def occurrence_pages(self, result):
         for x in result:
             if 'rank' not in x or x['rank'] != 'SPECIES':
                 continue
             try:
-                result_occ = []
-                offset = 0
-                count = 1
-                limit = 300
-                while offset < count:
-                    params = [
-                        ("country", "BR"), ("taxon_key", x["usageKey"],), ("offset", offset), ("limit", limit)
-                    ]
-                    response = requests.get(url, params=params, timeout=20)
-                    soup = BeautifulSoup(response.text, features="html.parser")
-
-                    a = json.loads(soup.text)
-                    offset += limit
-                    count = a["count"]
-                    if offset > count:
-                        offset = count
-
-                    print("GBIF: %s ...%s/%s" % (x['scientificName'], offset, count))
-                    result_occ += a["results"]
-                if len(result_occ):
-                    return result_occ
+                count = self.count(x["usageKey"])
+            except RequestException:
+                raise
             except:
-                pass
+                continue
+            if count:
+                return self.pages(x, count)
+
+    def occurrence(self, result):
+        pages = self.occurrence_pages(result)
+        if pages:
+            return list(chain.from_iterable(pages)) or None
 
     def write(self, occorencias, save_as):
-        parametros = ['scientificName', 'country', 'specificEpithet', 'decimalLatitude', 'decimalLongitude', 'month',
-                      'year',
-                      'datasetName', 'kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species', 'recordedBy']
-        arr = []
-        for i in occorencias:
-
-            obj = {}
-            for j in i.keys():
-                if j in parametros:
-                    obj.update({j: [i[j]]})
-            arr.append(pd.DataFrame.from_dict(obj))
-        if len(arr) > 0:
-            file = pd.concat(arr, sort=False) # foi apagado o sort = False
-            file.to_csv(save_as.open('w', encoding='utf-8'), index=False, index_label=False)
+        self.write_pages([occorencias], save_as)
+
+    def write_pages(self, pages, save_as, query=None):
+        query = names.key(query or save_as.stem)
+        frames = (to_frame(page, [x for x in PARAMETROS if any(x in i for i in page)]) for page in pages)
+        if self.store:
+            return self.store.append_pages(query, frames)
+        rows = write_csv(frames, save_as)
+        if rows:
+            self.index.add(query, save_as)
+        return rows
 
     def run(self, query, force=False):
-        file = self.output / (query + '.csv')
-        if not force and file.exists():
+        file = self.output / (names.filename(query) + '.csv')
+        if not force and self._has(query):
             print('[Gbif log]: %s' % query)
             return
+        if not force and self.negative.get(names.key(query), ttl=self.negative_ttl):
+            print('[Gbif log]: %s não encontrado' % query)
+            return
+        corrected = None
         result = self.search(query)
         if not result:
             assss = Project()
-            result = self.search(assss.correct_name(query))
+            corrected = assss.correct_name(query)
+            result = self.search(corrected)
         if not result:
+            self.negative.put(names.key(query), {'corrected': corrected})
             return
-        x = self.occurrence(result)
-        if not x:
+        x = self.occurrence_pages(result)
+        if not x or not self.write_pages(x, file, query):
+            self.negative.put(names.key(query), {'corrected': corrected})
             return
-        if x:
-            self.write(x, file)
-            print('[gbif download]: %s' % query)
+        self.negative.remove(names.key(query))
+        print('[gbif download]: %s' % query)
 
 
 if __name__ == '__main__':
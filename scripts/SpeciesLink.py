@@ -1,90 +1,168 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import time
 from pathlib import Path
 
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from requests import ReadTimeout
+from requests import HTTPError, ReadTimeout, RequestException
 
+import names
+from occurrences import OccurrenceStore, fetch_pages, to_frame, write_csv
+from parsing import has_class, tree
 from project import Project
+from session import make_session
+from store import Index, Store, NEGATIVE_TTL
+
+# result pages of one species fetched at the same time
+FANOUT = 2
+# attempts at one page, waiting BACKOFF, 2 * BACKOFF, ... seconds between them
+RETRIES = 4
+BACKOFF = 1
 
 
 class SpeciesLink:
-    def __init__(self, file='SpeciesLink_log.csv', path=Path('.')):
-        self.array = []
+    def __init__(self, file='SpeciesLink_log.csv', path=Path('.'), storage='csv', session=None, workers=1,
+                 negative_ttl=NEGATIVE_TTL, fanout=FANOUT):
+        self.session = session or make_session(workers * fanout)
+        self.fanout = fanout
         self.path = path
         self.output = self.path / 'Splink'
         self.output.mkdir(parents=True, exist_ok=True)
+        self.index = Index(self.output)
+        self.negative = Store(self.output / 'index.db', 'negative')
+        self.negative_ttl = negative_ttl
+        self.store = OccurrenceStore(self.path, 'splink') if storage == 'parquet' else None
 
-    def search(self, query):
-        if not query: return
-        self.array = []
-        offset = 0
-        max = 100
-        while offset < max:
+    def _has(self, query):
+        if self.store:
+            return query in self.store
+        # a result whose file was deleted is downloaded again
+        return self.index.file(query) is not None
+
+    def page(self, query, offset):
+        """
+        Returns (records, next offset, total) of one result page, or None when
+        nothing was found. Timeouts and error pages are tried again RETRIES
+        times, then raised.
+        """
+        error = None
+        for attempt in range(RETRIES):
+            if attempt:
+                time.sleep(BACKOFF * 2 ** (attempt - 1))
             try:
-                response = requests.post(
+                response = self.session.post(
                     'http://www.splink.org.br/mod_perl/searchHint?ts_genus=%s&offset=%s' % (query, offset), timeout=20)
                 if response.status_code == 200:
-                    data = BeautifulSoup(response.text, features="html.parser")
-                    a = data.select_one("#div_hint_summary")
-                    if not a:
-                        print("Elementos?", query)
-                        return
-                    if a.select_one('tr > th > b').text == 'Nenhum registro encontrado.Tente usar a busca fonética.':
-                        print("Vazia?", query)
-                        return
-                    a = a.select("ll")
-                    offset = int(a[1].text)
-                    max = int(a[2].text)
-                    print("Splink: %s  ...%s/%s" % (query, offset, max))
-                    self.array = self.array + data.select(".record")[1:]
+                    return self.parse(query, response.text)
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    # the same request gets the same answer
+                    response.raise_for_status()
+                error = HTTPError('%s %s' % (response.status_code, response.url), response=response)
             except ReadTimeout as e:
                 print(e)
-        return True
+                error = e
+        raise error
+
+    def parse(self, query, html):
+        # the records are read right away with XPath, so no tree outlives its page
+        data = tree(html)
+        a = data.xpath('//*[@id="div_hint_summary"]')
+        if not a:
+            print("Elementos?", query)
+            return
+        b = a[0].xpath('.//tr/th/b')
+        if b and b[0].text_content() == 'Nenhum registro encontrado.Tente usar a busca fonética.':
+            print("Vazia?", query)
+            return
+        a = [x.text_content() for x in a[0].xpath('.//ll')]
+        print("Splink: %s  ...%s/%s" % (query, a[1], a[2]))
+        records = [self.record(i, query) for i in data.xpath('//*[%s]' % has_class('record'))[1:]]
+        return records, int(a[1]), int(a[2])
+
+    def pages(self, query, first):
+        # the first page gives the page size and the total, so the other offsets
+        # are known: at most `fanout` pages are in flight, given back in order
+        records, size, max = first
+        yield records
+        if not records or size <= 0:
+            return
+        for _, x in fetch_pages(lambda offset: self.page(query, offset), range(size, max, size), self.fanout):
+            if not x or not x[0]:
+                # a page in the middle is missing or empty: the result is not saved as if it were complete
+                raise RequestException('SpeciesLink: %s, página sem registros antes do fim (%s)' % (query, max))
+            yield x[0]
+
+    def search(self, query):
+        """
+        Fetches the first page and returns an iterator over all the pages of
+        records, the next ones being fetched as it is consumed.
+        """
+        if not query: return
+        first = self.page(query, 0)
+        if first:
+            return self.pages(query, first)
+
+    def key(self, query):
+        # SpeciesLink searches genus + epithet only
+        return names.species(query)
 
     def run(self, input, force=False):
-        query = " ".join(input.split(" ")[:2])
+        query = self.key(input)
 
-        file = self.output / (query + '.csv')
-        if not force and file.exists():
+        file = self.output / (names.filename(query) + '.csv')
+        if not force and self._has(query):
             print('[Splink log]: %s' % query)
             return
+        if not force and self.negative.get(query, ttl=self.negative_ttl):
+            print('[Splink log]: %s não encontrado' % query)
+            return
+        if names.genus_only(query):
+            # SpeciesLink would answer with every record of the genus
+            print('[Splink log]: %s sem epíteto' % query)
+            self.negative.put(query, {'corrected': None})
+            return
 
         x = self.search(query)
         if not x:
             assss = Project()
-            x = self.search(assss.correct_name(query))
+            corrected = assss.correct_name(query)
+            x = self.search(corrected)
+            if not x:
+                self.negative.put(query, {'corrected': corrected})
 
-        if x:
-            self.write(query, file)
+        if x and self.write(query, file, x):
+            self.negative.remove(query)
             print('[splink download]: %s' % query)
 
     def _get(self, query):
-        x = (" ".join(query.split(" ")[:2]), query)
-        z = list(self.output.glob('**/*%s.csv' % x[0]))
-        if len(z) > 0:
-            return pd.read_csv(z[0].open('r', encoding='utf-8'))
-
-    def write(self, query, save_as):
-        lista = []
-        for i in self.array:
-            obj = {}
-            a = i.select_one("td > span")
-            js = a['onclick'].split(",")
-            x = i.select('td')
-            y = x[1].select('span > span')
-            for j in y:
-                text = j.text.replace('[lat: ', '')
-                text = text.replace(' long: ', '')
-                text = text.replace(';', ' & ')
-                obj.update({j['class'][0]: [text]})
-            obj.update({'input': [query], 'idx': [js[0].split("(")[1]]})
-            lista.append(pd.DataFrame.from_dict(obj))
-        if len(lista) > 0:
-            file = pd.concat(lista, sort=False)
-            file.to_csv(save_as.open('w', encoding='utf-8'), index=False, index_label=False)
+        if self.store:
+            return self.store.read(self.key(query))
+        z = self.index.file(self.key(query))
+        if z:
+            return pd.read_csv(z.open('r', encoding='utf-8'))
+
+    def record(self, i, query):
+        obj = {}
+        a = i.xpath('.//td/span')[0]
+        js = a.get('onclick').split(",")
+        x = i.xpath('.//td')
+        y = x[1].xpath('.//span/span')
+        for j in y:
+            text = j.text_content().replace('[lat: ', '')
+            text = text.replace(' long: ', '')
+            text = text.replace(';', ' & ')
+            obj.update({j.get('class').split()[0]: text})
+        obj.update({'input': query, 'idx': js[0].split("(")[1]})
+        return obj
+
+    def write(self, query, save_as, pages):
+        frames = (to_frame(records) for records in pages)
+        if self.store:
+            return self.store.append_pages(query, frames)
+        rows = write_csv(frames, save_as)
+        if rows:
+            self.index.add(query, save_as)
+        return rows
 
 
 if __name__ == "__main__":
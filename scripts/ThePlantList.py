@@ -4,21 +4,40 @@ from pathlib import Path
 from queue import Queue
 
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+from requests import RequestException
 
+import names
+from checklist import LocalNames
+from names import split_name
+from parsing import soup
 from project import Project
+from session import make_session
+from store import Index, Store, NEGATIVE_TTL
+from synonyms import Synonyms
 
 
-class ThePlantList:
-    def __init__(self, file="ThePlantList_log.csv", path=Path('.')):
+class ThePlantList(LocalNames):
+    source = 'plant'
+
+    def __init__(self, file="ThePlantList_log.csv", path=Path('.'), session=None, workers=1,
+                 negative_ttl=NEGATIVE_TTL, checklist=None):
         self.sinonimos = []
+        # local copy of the checklist (checklist.Checklist): names found there skip the site
+        self.checklist = checklist
+        self.session = session or make_session(workers)
         self.scientif_name = None
         self.status = None
         self.species = None
         self.path = path
         self.output = self.path / 'plant'
         self.output.mkdir(parents=True, exist_ok=True)
+        # names with the author: two homonyms are two taxa
+        self.index = Index(self.output, key=names.author_key)
+        self.negative = Store(self.output / 'index.db', 'negative')
+        self.negative_ttl = negative_ttl
+        # synonym -> accepted name of every result written
+        self.synonyms = Synonyms(self.output / 'index.db')
+        self.synonyms.scan(self.index)
         self.file_name = file
 
         self.file = Queue()
@@ -33,8 +52,10 @@ class ThePlantList:
             ('q', query),
         )
 
-        response = requests.get('http://www.theplantlist.org/tpl1.1/sc', params=params, timeout=20)
-        x = BeautifulSoup(response.text, features="html.parser")
+        response = self.session.get('http://www.theplantlist.org/tpl1.1/sc', params=params, timeout=20)
+        # a 5xx/429 page is a network error, not a name that was not found
+        response.raise_for_status()
+        x = soup(response.text, 'rs')
         a = x.select('rs')
         if not len(a):
             return query
@@ -43,9 +64,11 @@ class ThePlantList:
     def handle_genus_response(self, query):
 
         try:
-            response = requests.get(self.auto_complete(query), timeout=20)
+            response = self.session.get(self.auto_complete(query), timeout=20)
+            response.raise_for_status()
             data = response.text
-            html = BeautifulSoup(data, 'html.parser')
+            # only what is read below: the results table, its title and the name headers
+            html = soup(data, 'section', 'h1', 'tbody')
 
             rows = html.select("tbody > tr")
             obj = {}
@@ -76,6 +99,8 @@ class ThePlantList:
                         sinonimos.append(cells[0].get_text().strip())
                     obj.update({"sinonimos": [sinonimos]})
                 return obj
+        except RequestException:
+            raise
         except:
             pass
 
@@ -84,6 +109,24 @@ class ThePlantList:
     #         url = self.get_url(sp.split(" ")[0].strip())
     #         self.handle_genus_response(url)
 
+    def from_checklist(self, query, x):
+        taxon, accepted = x['taxon'], x['accepted']
+        obj = {"scientificname": [taxon['name']],
+               "scientificnameauthorship": [taxon['authorship']],
+               'species': [taxon['genus'] + " " + taxon['epithet']],
+               "status": [taxon['status'].lower()]}
+        if accepted is not None and not taxon['accepted']:
+            obj.update({"acceptednameusage": [accepted['name']]})
+        if taxon['accepted'] and x['synonyms']:
+            obj.update({"sinonimos": [x['synonyms']]})
+        obj.update({"Nome Entrada": query})
+        return obj
+
+    def from_synonym(self, query, name, accepted):
+        genus, epithet, _, authorship = split_name(name)
+        return {"scientificname": [name], "scientificnameauthorship": [authorship], 'species': [genus + " " + epithet],
+                "status": ['synonym'], "acceptednameusage": [accepted], "Nome Entrada": query}
+
     def search(self, query):
         if not query: return
         url = self.get_url(query)
@@ -95,9 +138,9 @@ class ThePlantList:
             return x
 
     def _get(self, query):
-        z = list(self.output.glob('**/*%s.csv' % query))
-        if len(z) > 0:
-            return pd.read_csv(z[0].open('r', encoding='utf-8'))
+        z = self.index.file(query)
+        if z:
+            return pd.read_csv(z.open('r', encoding='utf-8'))
 
     def close(self, plants):
         try:
@@ -114,9 +157,8 @@ class ThePlantList:
 
             file2 = []
             for x in list(plants):
-                z = list(self.output.glob('%s.csv' % x))
-                if len(z) > 0:
-                    ass = pd.read_csv(z[0].open('r', encoding='utf-8'))
+                ass = self._get(x)
+                if ass is not None:
                     file2.append(ass)
                 else:
                     file2.append(pd.DataFrame.from_dict({'Nome Entrada': [x]}))
@@ -134,20 +176,31 @@ class ThePlantList:
 
     def write(self, row, query):
         file = pd.DataFrame.from_dict(row)
-        file.to_csv(self.output / (query + '.csv'), index=False)
+        save_as = self.output / (names.filename(query, names.author_key) + '.csv')
+        file.to_csv(save_as, index=False)
+        self.index.add(query, save_as)
+        self.synonyms.add_record(row)
 
     def run(self, query, force=False):
-        if not force and len(list(self.output.glob('**/*%s.csv' % query))) > 0:
+        # file() and not `in`: a result whose file was deleted is downloaded again
+        if not force and self.index.file(query):
             print('[Plant log]: %s' % query)
             return
+        if not force and self.negative.get(names.author_key(query), ttl=self.negative_ttl):
+            print('[Plant log]: %s não encontrado' % query)
+            return
 
-        li = self.search(query)
+        li = self.local(query) or self.known(query) or self.search(query)
         if not li:
             assss = Project()
-            li = self.search(assss.correct_name(query))
+            corrected = assss.correct_name(query)
+            li = self.local(corrected) or self.known(corrected) or self.search(corrected)
+            if not li:
+                self.negative.put(names.author_key(query), {'corrected': corrected})
 
         if li:
             self.write(li, query)
+            self.negative.remove(names.author_key(query))
             print('[plant download]: %s' % query)
         return li
 
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-lookup latency and hit rate of SymSpell lookup_compound over
+dict_final.txt against matcher.Matcher, for misspelled names with authors.
+Without a species list, species are made up from the genera and epithets
+of the dictionary.
+
+    python bench_matcher.py [species.txt] [queries]
+"""
+import random
+import sys
+import time
+
+from matcher import Matcher
+from names import split_name
+from project import DICTIONARY, Project
+
+rand = random.Random(0)
+
+
+def synthetic(words, n=30000):
+    genera = sorted(x for x in words if x[:1].isupper() and x[1:].islower() and len(x) > 3)
+    epithets = sorted(x for x in words if x.islower() and x.isalpha() and len(x) > 3)
+    return ['%s %s' % (rand.choice(genera), rand.choice(epithets)) for _ in range(n)]
+
+
+def typo(word):
+    if len(word) < 3:
+        return word
+    i = rand.randrange(1, len(word))
+    return rand.choice([word[:i] + word[i + 1:], word[:i] + rand.choice('aeiou') + word[i:],
+                        word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]])
+
+
+def queries(species, n):
+    for name in rand.sample(species, n):
+        genus, epithet, _, _ = split_name(name)
+        if rand.random() < 0.3:
+            genus = typo(genus)
+        yield name, '%s %s (Mart.) Solms' % (genus, typo(epithet))
+
+
+def bench(name, function, cases):
+    hits = 0
+    start = time.perf_counter()
+    for expected, query in cases:
+        x = function(query)
+        hits += bool(x) and x.lower().startswith(expected.lower() + ' ')
+    total = time.perf_counter() - start
+    print('%-9s %8.3f ms/lookup  %5.1f%% right' % (name, total / len(cases) * 1000, hits * 100 / len(cases)))
+
+
+if __name__ == '__main__':
+    project = Project._Project(DICTIONARY)
+    if len(sys.argv) > 1:
+        species = [x.strip() for x in open(sys.argv[1], encoding='utf-8') if x.strip()]
+    else:
+        species = synthetic(project.sym_spell._words)
+    start = time.perf_counter()
+    matcher = Matcher(species)
+    print('%s species, %s genera, matcher built in %.2f s' % (len(species), len(matcher), time.perf_counter() - start))
+    cases = list(queries(species, int(sys.argv[2]) if len(sys.argv) > 2 else 300))
+    bench('symspell', lambda x: project.sym_spell.lookup_compound(x, 2)[0].term, cases)
+    bench('matcher', matcher.match, cases)
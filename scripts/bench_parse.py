@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parse time per page of the html.parser soups used before against parsing.py,
+over the pages saved by --http-cache (SpeciesLink results, ThePlantList and
+Flora do Brasil search pages). Without a folder a SpeciesLink result page of
+`records` synthetic records is used.
+
+    python bench_parse.py [http-cache folder | records]
+"""
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from SpeciesLink import SpeciesLink
+from parsing import soup
+
+splink = SpeciesLink(path=Path(tempfile.mkdtemp()))
+
+
+def old_splink(html):
+    data = BeautifulSoup(html, features="html.parser")
+    a = data.select_one("#div_hint_summary").select("ll")
+    records = []
+    for i in data.select(".record")[1:]:
+        obj = {}
+        x = i.select('td')
+        for j in x[1].select('span > span'):
+            obj.update({j['class'][0]: j.text})
+        obj.update({'idx': i.select_one("td > span")['onclick'].split(",")[0].split("(")[1]})
+        records.append(obj)
+    return records, int(a[1].text), int(a[2].text)
+
+
+def new_splink(html):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return splink.parse('', html)
+
+
+def plant(html):
+    return html.select("tbody > tr"), html.select_one('section > h2'), html.select('h1')
+
+
+def old_plant(html):
+    return plant(BeautifulSoup(html, 'html.parser'))
+
+
+def new_plant(html):
+    return plant(soup(html, 'section', 'h1', 'tbody'))
+
+
+def old_flora(html):
+    return BeautifulSoup(html, features="html.parser").select_one("#carregaTaxonGrupoIdDadosListaBrasil")
+
+
+def new_flora(html):
+    return soup(html, id='carregaTaxonGrupoIdDadosListaBrasil').select_one("#carregaTaxonGrupoIdDadosListaBrasil")
+
+
+PARSERS = {
+    'searchHint': ('splink', old_splink, new_splink),
+    'theplantlist.org/tpl1.1/search': ('plant', old_plant, new_plant),
+    'BemVindoConsultaPublicaConsultar': ('flora', old_flora, new_flora),
+}
+
+
+def saved(folder):
+    for file in Path(folder).glob('*/*'):
+        meta, content = zlib.decompress(file.read_bytes()).split(b'\n', 1)
+        meta = json.loads(meta.decode('utf-8'))
+        for url, parsers in PARSERS.items():
+            if url in meta['url']:
+                yield parsers, content.decode(meta['encoding'] or 'utf-8', 'replace')
+
+
+def synthetic(n):
+    records = ''.join('<tr class="record"><td><span onclick="showRecord(%d,1)">+</span></td><td><span>'
+                      '<span class="tGa">Lemna</span> <span class="tEa">gibba</span> <span class="cL">Coletor %d</span>'
+                      ' <span class="lA">[lat: -23.%d</span><span class="lO"> long: -46.1;</span></span></td></tr>'
+                      % (i, i, i) for i in range(n))
+    yield PARSERS['searchHint'], ('<html><body><div id="div_hint_summary"><ll>0</ll><ll>%d</ll><ll>%d</ll></div>'
+                                  '<table><tr class="record"><td></td></tr>%s</table></body></html>' % (n, n, records))
+
+
+def bench(pages):
+    times = {}
+    for (name, old, new), html in pages:
+        for label, function in (('old', old), ('new', new)):
+            start = time.perf_counter()
+            function(html)
+            times.setdefault((name, label), []).append(time.perf_counter() - start)
+    for (name, label), x in sorted(times.items()):
+        print('%-6s %-3s %5d pages  %8.1f ms/page' % (name, label, len(x), sum(x) / len(x) * 1000))
+
+
+if __name__ == '__main__':
+    arg = sys.argv[1] if len(sys.argv) > 1 else '1000'
+    bench(synthetic(int(arg)) if arg.isdigit() else saved(arg))
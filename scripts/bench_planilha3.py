@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Planilha 3 assembly over synthetic occurrence frames: the row loop with
+x.loc[i] (how it used to be done) against main.planilha_3, one column
+projection per name appended with Sheet.append_frame.
+
+    python bench_planilha3.py [occurrences per name] [names] [xlsx|xls|csv|parquet]
+"""
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from main import PARAMS, PLANILHA_3, planilha_3
+from sheets import open_book
+
+rand = random.Random(0)
+
+
+def gbif(n):
+    return pd.DataFrame({
+        'scientificName': 'Lemna gibba L.', 'country': 'Brazil', 'kingdom': 'Plantae', 'phylum': 'Tracheophyta',
+        'class': 'Liliopsida', 'order': 'Alismatales', 'family': 'Araceae', 'genus': 'Lemna', 'species': 'Lemna gibba',
+        'decimalLatitude': [rand.uniform(-33, 5) for _ in range(n)],
+        'decimalLongitude': [rand.uniform(-73, -34) if i % 9 else None for i in range(n)],
+        'recordedBy': ['Coletor %d' % i if i % 7 else None for i in range(n)]})
+
+
+def splink(n):
+    return pd.DataFrame({
+        'tF': 'Araceae', 'tGa': 'Lemna', 'tEa': ['gibba' if i % 11 else None for i in range(n)],
+        'cL': ['Coletor %d' % i for i in range(n)], 'lC': 'Brasil',
+        'lA': ['%.4f' % rand.uniform(-33, 5) for _ in range(n)], 'lO': ['%.4f' % rand.uniform(-73, -34) for _ in range(n)],
+        'input': 'Lemna gibba', 'idx': [str(i) for i in range(n)]})
+
+
+def old(sheet, site, task, x):
+    row_header = PARAMS[site]
+    for i in range(len(x)):
+        row = x.loc[i]
+        values = [task]
+        for j in row_header[1:]:
+            if type(j) == type(''):
+                values.append(row[j] if j in row.keys().tolist() and row[j] == row[j] else None)
+            else:
+                values.append(str(row[j[0]]) + ' ' + str(row[j[1]]))
+        sheet.append(values)
+
+
+def new(sheet, site, task, x):
+    sheet.append_frame(planilha_3(site, task, x))
+
+
+def bench(name, function, frames, format):
+    with tempfile.TemporaryDirectory() as tmp:
+        book = open_book(Path(tmp) / ('Planilha 3.' + format))
+        sheet = book.sheet('Planilha 3', PLANILHA_3, numeric=['Latitude', 'Longitude'])
+        start = time.perf_counter()
+        for site, task, x in frames:
+            function(sheet, site, task, x)
+        book.close()
+        total = time.perf_counter() - start
+    print('%-4s %8.2f s  %10.0f rows/s  %s rows' % (name, total, sheet.rows / total, sheet.rows))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    names = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    format = sys.argv[3] if len(sys.argv) > 3 else 'csv'
+    frames = [(site, 'Nome %d' % i, gbif(n) if site == 'gbif' else splink(n))
+              for i in range(names) for site in ('gbif', 'splink')]
+    bench('old', old, frames, format)
+    bench('new', new, frames, format)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-name latency of the Flora do Brasil lookup chain (4 serial requests per
+name) against a local stand-in server, with and without a pooled session.
+
+    python bench_session.py [names]
+"""
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from session import make_session
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'[]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalSession(requests.Session):
+    """Sends every request to the stand-in server, whatever the host of the url."""
+
+    def __init__(self, address, session=None):
+        super().__init__()
+        self.address = address
+        if session:
+            self.adapters = session.adapters
+            self.headers = session.headers
+
+    def request(self, method, url, *args, **kwargs):
+        url = urlunsplit(('http', self.address) + tuple(urlsplit(url))[2:])
+        return super().request(method, url, *args, **kwargs)
+
+
+class NoPoolSession(LocalSession):
+    """Same as calling the module level requests.get: a new connection per request."""
+
+    def request(self, method, url, *args, **kwargs):
+        with LocalSession(self.address) as session:
+            return session.request(method, url, *args, **kwargs)
+
+
+def chain(session):
+    session.get('http://floradobrasil.jbrj.gov.br/reflora/listaBrasil/ConsultaPublicaUC/'
+                'BemVindoConsultaPublicaAutoCompleteNomeCompleto.do', timeout=5)
+    session.get('http://floradobrasil.jbrj.gov.br/reflora/listaBrasil/ConsultaPublicaUC/'
+                'BemVindoConsultaPublicaConsultar.do', timeout=5)
+    session.get('http://floradobrasil.jbrj.gov.br/reflora/listaBrasil/ConsultaPublicaUC/'
+                'ResultadoDaConsultaCarregaTaxonGrupo.do', timeout=5)
+    session.get('http://servicos.jbrj.gov.br/flora/taxon/x', timeout=5)
+
+
+def bench(name, session, names):
+    start = time.perf_counter()
+    for _ in range(names):
+        chain(session)
+    total = time.perf_counter() - start
+    print('%-10s %8.3f ms/name  (%d names, %.2f s)' % (name, total * 1000 / names, names, total))
+
+
+if __name__ == '__main__':
+    names = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = '%s:%s' % server.server_address
+
+    bench('requests', NoPoolSession(address), names)
+    bench('session', LocalSession(address, make_session()), names)
+    server.shutdown()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Record -> table conversion of GBIF.write: one DataFrame per record glued with
+pd.concat (how it used to be done) against to_frame over the pages. The old
+way builds a DataFrame per record, so at 100000 records it takes minutes;
+--new-only leaves it out.
+
+    python bench_write.py [records] [--new-only]
+"""
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from GBIF import PARAMETROS
+from occurrences import to_frame
+
+
+def records(n):
+    rand = random.Random(0)
+    for i in range(n):
+        record = {'key': i, 'scientificName': 'Lemna gibba L.', 'country': 'Brazil', 'specificEpithet': 'gibba',
+                  'decimalLatitude': rand.uniform(-33, 5), 'decimalLongitude': rand.uniform(-73, -34),
+                  'month': rand.randint(1, 12), 'year': rand.randint(1900, 2019), 'datasetName': 'Herbário',
+                  'kingdom': 'Plantae', 'phylum': 'Tracheophyta', 'class': 'Liliopsida', 'order': 'Alismatales',
+                  'family': 'Araceae', 'genus': 'Lemna', 'species': 'Lemna gibba', 'recordedBy': 'Coletor %d' % i}
+        if i % 7 == 0:
+            del record['recordedBy']
+        yield record
+
+
+def old(occorencias):
+    arr = []
+    for i in occorencias:
+        obj = {}
+        for j in i.keys():
+            if j in PARAMETROS:
+                obj.update({j: [i[j]]})
+        arr.append(pd.DataFrame.from_dict(obj))
+    return pd.concat(arr, sort=False)
+
+
+def new(occorencias, limit=300):
+    pages = [[{j: i[j] for j in PARAMETROS if j in i} for i in occorencias[x:x + limit]]
+             for x in range(0, len(occorencias), limit)]
+    return pd.concat([to_frame(page, [x for x in PARAMETROS if any(x in i for i in page)]) for page in pages])
+
+
+def bench(name, function, data):
+    start = time.perf_counter()
+    frame = function(data)
+    total = time.perf_counter() - start
+    # second pass for the memory, tracemalloc makes the first one several times slower
+    del frame
+    tracemalloc.start()
+    frame = function(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-4s %9.2f s  %9.1f MB peak  %s rows' % (name, total, peak / 2 ** 20, len(frame)))
+
+
+if __name__ == '__main__':
+    args = [x for x in sys.argv[1:] if not x.startswith('--')]
+    n = int(args[0]) if args else 100000
+    data = list(records(n))
+    if '--new-only' not in sys.argv:
+        bench('old', old, data)
+    bench('new', new, data)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import sqlite3
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pandas as pd
+
+from names import authorship, canonical_key, name_key, query_keys
+
+# file of the checklists in the cache folder
+CHECKLIST = 'checklist.db'
+CHUNK_SIZE = 50000
+
+# statuses of accepted names in the exports (Flora do Brasil IPT, The Plant List)
+ACCEPTED = {'NOME_ACEITO', 'ACCEPTED'}
+
+RANKS = {'VARIEDADE': 'var.', 'SUB_ESPECIE': 'subsp.', 'FORMA': 'f.', 'variety': 'var.', 'subspecies': 'subsp.',
+         'form': 'f.', 'var.': 'var.', 'subsp.': 'subsp.', 'f.': 'f.'}
+
+COLUMNS = ['id', 'name', 'canonical', 'authorship', 'family', 'genus', 'epithet', 'rank', 'infra', 'status',
+           'accepted_id']
+
+
+class Checklist:
+    """
+    Local copy of the Flora do Brasil and The Plant List checklists, imported
+    from their bulk exports, indexed by exact name, by canonical name (genus
+    epithet [infraspecific epithet], no authorship) and by accepted name, so
+    a name and its accepted name/synonyms are found without going to the site.
+    """
+
+    def __init__(self, file):
+        self.location = Path(file)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.location), timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS taxa (source TEXT, %s, name_key TEXT, accepted INTEGER, '
+                        'PRIMARY KEY (source, id))' % ', '.join('%s TEXT' % x for x in COLUMNS))
+        self.db.execute('CREATE INDEX IF NOT EXISTS taxa_name ON taxa (source, name_key)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS taxa_canonical ON taxa (source, canonical)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS taxa_accepted ON taxa (source, accepted_id)')
+        self.db.commit()
+        self.sources = {x for x, in self.db.execute('SELECT DISTINCT source FROM taxa')}
+
+    def __contains__(self, source):
+        return source in self.sources
+
+    def import_frames(self, source, frames):
+        """Replaces the checklist of `source` with the rows of frames (COLUMNS)."""
+        rows = 0
+        with self.lock:
+            self.db.execute('DELETE FROM taxa WHERE source = ?', (source,))
+            for frame in frames:
+                frame = frame.reindex(columns=COLUMNS).fillna('')
+                frame['name_key'] = frame['name'].map(name_key)
+                frame['accepted'] = frame['status'].str.upper().isin(ACCEPTED).astype(int)
+                self.db.executemany('INSERT OR REPLACE INTO taxa VALUES (?, %s)' % ', '.join(['?'] * (len(COLUMNS) + 2)),
+                                    ([source] + x for x in frame.values.tolist()))
+                rows += len(frame)
+                print('[checklist %s]: %s nomes' % (source, rows))
+            self.db.commit()
+        self.sources.add(source)
+        return rows
+
+    def import_dwca(self, source, path):
+        """Darwin Core archive (zip or unpacked folder) of the Flora do Brasil IPT."""
+        return self.import_frames(source, (self._dwca_frame(x) for x in read_dwca(path)))
+
+    def _dwca_frame(self, x):
+        column = lambda name: x[name].fillna('') if name in x else pd.Series('', index=x.index)
+        rank = column('taxonRank').map(lambda r: RANKS.get(r, ''))
+        infra = column('infraspecificEpithet')
+        return pd.DataFrame({
+            'id': column('taxonID').where(column('taxonID') != '', column('id')),
+            'name': column('scientificName'),
+            'canonical': [canonical_key(*y) for y in zip(column('genus'), column('specificEpithet'), infra)],
+            'authorship': column('scientificNameAuthorship'),
+            'family': column('family'),
+            'genus': column('genus'),
+            'epithet': column('specificEpithet'),
+            'rank': rank,
+            'infra': infra,
+            'status': column('taxonomicStatus'),
+            'accepted_id': column('acceptedNameUsageID'),
+        })
+
+    def import_tpl(self, source, path):
+        """CSV export of The Plant List 1.1 (one file per family, or all of them concatenated)."""
+        return self.import_frames(source, (self._tpl_frame(x) for x in
+                                           pd.read_csv(path, dtype=str, chunksize=CHUNK_SIZE, keep_default_na=False)))
+
+    def _tpl_frame(self, x):
+        name = (x['Genus'] + ' ' + x['Species'] + ' ' + x['Infraspecific rank'] + ' ' + x['Infraspecific epithet'] +
+                ' ' + x['Authorship']).map(lambda y: ' '.join(y.split()))
+        return pd.DataFrame({
+            'id': x['ID'],
+            'name': name,
+            'canonical': [canonical_key(*y) for y in zip(x['Genus'], x['Species'], x['Infraspecific epithet'])],
+            'authorship': x['Authorship'],
+            'family': x['Family'],
+            'genus': x['Genus'],
+            'epithet': x['Species'],
+            'rank': x['Infraspecific rank'],
+            'infra': x['Infraspecific epithet'],
+            'status': x['Taxonomic status in TPL'],
+            'accepted_id': x['Accepted ID'],
+        })
+
+    def _get(self, source, id):
+        if not id:
+            return None
+        with self.lock:
+            return self.db.execute('SELECT * FROM taxa WHERE source = ? AND id = ?', (source, id)).fetchone()
+
+    def find(self, source, query):
+        """
+        Row of the name, by exact name first and then by canonical name
+        (accepted ones first), as Synonyms.edge: by canonical name only when
+        the query has no authorship or the same one as the row (a homonym of
+        another author is another name).
+        """
+        exact, canonical = query_keys(query)
+        with self.lock:
+            row = self.db.execute('SELECT * FROM taxa WHERE source = ? AND name_key = ? ORDER BY accepted DESC LIMIT 1',
+                                  (source, exact)).fetchone()
+            if row or not canonical:
+                return row
+            rows = self.db.execute('SELECT * FROM taxa WHERE source = ? AND canonical = ? ORDER BY accepted DESC',
+                                   (source, canonical)).fetchall()
+        author = authorship(query)
+        for row in rows:
+            if not author or author == authorship(row['name']):
+                return row
+
+    def resolve(self, source, query):
+        """
+        {'taxon': row, 'accepted': row of the accepted name (or None), 'synonyms': [names]}
+        of a name, or None when it is not in the checklist of source.
+        """
+        row = self.find(source, query)
+        if row is None:
+            return None
+        accepted = row if row['accepted'] else self._get(source, row['accepted_id'])
+        synonyms = []
+        if accepted is not None:
+            with self.lock:
+                synonyms = [x for x, in self.db.execute(
+                    'SELECT name FROM taxa WHERE source = ? AND accepted_id = ? AND id != ?',
+                    (source, accepted['id'], accepted['id']))]
+        return {'taxon': row, 'accepted': accepted, 'synonyms': synonyms}
+
+
+class LocalNames:
+    """
+    local() and known() of the sources whose results are names (Flora do
+    Brasil, The Plant List): a name resolved without any request, from the
+    imported checklist or from the synonym graph. The source gives its name
+    in the checklist and turns what was found into the dict its search()
+    gives, with from_checklist and from_synonym.
+    """
+    source = None
+
+    def local(self, query):
+        """The same dict search() gives, from the local checklist, or None."""
+        if not query or self.checklist is None or self.source not in self.checklist:
+            return None
+        x = self.checklist.resolve(self.source, query)
+        return self.from_checklist(query, x) if x else None
+
+    def known(self, query):
+        """The dict search() gives for a name already seen as a synonym, from the synonym graph, or None."""
+        accepted = self.synonyms.accepted(query)
+        if not accepted:
+            return None
+        return self.from_synonym(query, self.synonyms.synonym(query) or query, accepted)
+
+
+def read_dwca(path):
+    """Chunks (DataFrames named by the Darwin Core terms) of the core file of an archive."""
+    path = Path(path)
+    if path.is_dir():
+        open_file = lambda name: (path / name).open('rb')
+    else:
+        archive = zipfile.ZipFile(str(path))
+        open_file = archive.open
+    with open_file('meta.xml') as f:
+        core = ET.parse(f).getroot().find('{*}core')
+    fields = {int(x.get('index')): x.get('term').rsplit('/', 1)[-1] for x in core.findall('{*}field')}
+    id = core.find('{*}id')
+    if id is not None:
+        fields.setdefault(int(id.get('index')), 'id')
+    sep = core.get('fieldsTerminatedBy', '\t').encode().decode('unicode_escape')
+    skip = int(core.get('ignoreHeaderLines', '0'))
+    with open_file(core.find('{*}files/{*}location').text) as f:
+        text = io.TextIOWrapper(f, encoding=core.get('encoding', 'utf-8'))
+        for chunk in pd.read_csv(text, sep=sep, header=None, skiprows=skip, dtype=str, chunksize=CHUNK_SIZE,
+                                 quoting=3, keep_default_na=False):
+            yield chunk.rename(columns=fields)
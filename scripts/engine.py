@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from flight import InOrder
+from session import AsyncSession, aiohttp
+
+# requests in flight per source, kept under what each site tolerates
+LIMITS = {'flora': 4, 'plant': 4, 'gbif': 8, 'splink': 2}
+
+CLIENTS = {'flora': 'florabrasil', 'plant': 'theplantlist', 'gbif': 'gbif', 'splink': 'splink'}
+
+
+class Engine:
+    """
+    Resolves the names of a Main with up to limits[site] names in flight per
+    source, an alternative to the run_/run_occorence_ loops of the GUI (one
+    blocking thread per source).
+
+    Only the HTTP requests are asynchronous: each source client gets an
+    AsyncSession, so they are made by aiohttp on this loop. The clients
+    themselves (search, parsing, writing) are blocking code and run on a pool
+    of sum(limits) threads, each one waiting on the loop while its request is
+    in flight; the semaphores keep each source under its limit. Names go to
+    main.queue_planilha_1 once Flora and PlantList are done with them and with
+    every name before them (input order, as the GUI), and the occurrences to
+    main.queue_g_s, so the Planilha_1/2/3 threads of main must be running.
+    """
+
+    def __init__(self, main, limits=None, progress=None):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for the asyncio engine')
+        self.main = main
+        self.limits = dict(LIMITS, **(limits or {}))
+        self.progress = progress or {}
+
+    def run(self, names=None):
+        asyncio.run(self._run(self.main.species if names is None else names))
+
+    async def _run(self, names):
+        loop = asyncio.get_running_loop()
+        self.semaphores = {site: asyncio.Semaphore(n) for site, n in self.limits.items()}
+        self.pool = ThreadPoolExecutor(sum(self.limits.values()))
+        clients = {site: self.main[name] for site, name in CLIENTS.items()}
+        sessions = {site: client.session for site, client in clients.items()}
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as http:
+            for site, client in clients.items():
+                client.session = AsyncSession(http, loop, self.limits[site], getattr(sessions[site], 'cache', None))
+            try:
+                occurrences = [asyncio.ensure_future(self.occurrences('gbif')),
+                               asyncio.ensure_future(self.occurrences('splink'))]
+                self.order = InOrder(self.main.queue_planilha_1.put)
+                await asyncio.gather(*(self.resolve(i, name) for i, name in enumerate(names)))
+                # Planilha_1 is the one that queues the accepted names for gbif/splink
+                await loop.run_in_executor(None, self.main.queue_planilha_1.join)
+                self.main.queue_gbif.put(None)
+                self.main.queue_splink.put(None)
+                await asyncio.gather(*occurrences)
+                # Planilha_2 looks up Flora again through these sessions: done before the loop stops
+                await loop.run_in_executor(None, self.main.queue_planilha_2.join)
+            finally:
+                for site, client in clients.items():
+                    client.session = sessions[site]
+                self.pool.shutdown()
+
+    async def work(self, site, task):
+        async with self.semaphores[site]:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.pool, self.main['do_work_' + site], task)
+                if site in self.progress:
+                    self.progress[site].put(('value', 1))
+            except Exception as e:
+                print("PASS", task, e)
+
+    async def resolve(self, i, name):
+        await asyncio.gather(self.work('flora', name), self.work('plant', name))
+        self.order.done(i, name)
+
+    async def occurrence(self, site, task):
+        await self.work(site, task)
+        self.main.queue_g_s.put((site, task))
+
+    async def occurrences(self, site):
+        loop = asyncio.get_running_loop()
+        queue = self.main['queue_' + site]
+        pending = []
+        while True:
+            task = await loop.run_in_executor(None, queue.get)
+            queue.task_done()
+            if task is None:
+                break
+            pending.append(asyncio.ensure_future(self.occurrence(site, task)))
+        await asyncio.gather(*pending)
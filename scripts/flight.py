@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+from concurrent.futures import Future
+
+
+class InOrder:
+    """
+    Releases items in the order of their index, whatever the order they are
+    done in: done(i, x) gives to release every item from the next index
+    expected up to the first one that is still missing.
+    """
+
+    def __init__(self, release):
+        self.release = release
+        self.lock = threading.Lock()
+        self.ready = {}
+        self.next = 0
+
+    def done(self, i, item):
+        # released under the lock, so two threads cannot swap their items
+        with self.lock:
+            self.ready[i] = item
+            while self.next in self.ready:
+                self.release(self.ready.pop(self.next))
+                self.next += 1
+
+
+class SingleFlight:
+    """
+    Runs fetch once per key: a call for a key that is already in flight waits
+    for the first one and gets its result, and a call for a key already done
+    gets the result right away. `saved` counts the fetches avoided (a waiter
+    that gets the error of a fetch that raised saved nothing). A fetch
+    that raises is forgotten, so the next call for its key tries again, and
+    so is a key given to forget().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.saved = 0
+
+    def do(self, key, fetch, *args):
+        with self.lock:
+            future = self.calls.get(key)
+            owner = future is None
+            if owner:
+                future = self.calls[key] = Future()
+        if not owner:
+            result = future.result()
+            with self.lock:
+                self.saved += 1
+            return result
+        try:
+            result = fetch(*args)
+        except BaseException as e:
+            with self.lock:
+                del self.calls[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def forget(self, key):
+        """Drops a finished key, so the next call for it fetches again."""
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None and future.done():
+                del self.calls[key]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the whole pipeline without the Tkinter interface.
+
+    python -m macrofitas run ListaMacrofita.xlsx --out resultado --workers 4
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from queue import Queue
+
+from checklist import CHECKLIST, Checklist
+from flight import InOrder
+from main import Main
+from occurrences import OccurrenceStore
+from session import ResponseCache
+from sheets import FORMATS, book_class
+from store import NEGATIVE_TTL
+
+
+class Scheduler:
+    """
+    Drives a Main without the GUI timer: every name goes to queue_planilha_1
+    once Flora and PlantList are both done with it and with every name before
+    it (the Planilhas keep the order of the input), and the occurrence queues
+    are consumed by their own worker pools.
+    """
+
+    def __init__(self, main, workers=None, engine='threads'):
+        self.main = main
+        self.workers = workers
+        self.engine = engine
+        self.files = Queue()
+        self.lock = threading.Lock()
+        self.done = {}
+        self.order = InOrder(main.queue_planilha_1.put)
+
+    def run(self):
+        # everything that can refuse to start does it here, before the Planilha
+        # threads, which would otherwise wait on their queues forever
+        engine = None
+        if self.engine == 'async':
+            from engine import Engine, LIMITS
+            engine = Engine(self.main, {site: self.workers for site in LIMITS} if self.workers else None)
+        for x in (self.main.Planilha1, self.main.Planilha2, self.main.Planilha3):
+            book_class(x)
+
+        errors = []
+        planilhas = [threading.Thread(target=self.planilha, args=(x, errors), daemon=True)
+                     for x in ('Planilha_1', 'Planilha_2', 'Planilha_3')]
+        for x in planilhas:
+            x.start()
+        try:
+            if engine:
+                engine.run()
+            else:
+                self.workers = self.workers or 1
+                occurrences = [threading.Thread(target=self.occurrences, args=(site, self.workers))
+                               for site in ('gbif', 'splink')]
+                for x in occurrences:
+                    x.start()
+                try:
+                    self.resolve()
+                    # Planilha_1 is the one that queues the accepted names for gbif/splink
+                    self.main.queue_planilha_1.join()
+                finally:
+                    self.main.queue_gbif.put(None)
+                    self.main.queue_splink.put(None)
+                    for x in occurrences:
+                        x.join()
+
+            self.main.queue_planilha_2.join()
+            self.main.queue_g_s.join()
+        finally:
+            self.main.task_done = True
+            self.main.task_occorence_done = True
+            for queue in (self.main.queue_planilha_1, self.main.queue_planilha_2, self.main.queue_g_s):
+                queue.put(None)
+        for x in planilhas:
+            x.join()
+        if errors:
+            raise errors[0]
+        # the parquet storage gets new files on every flush: one per genus again
+        for x in (self.main.gbif, self.main.splink):
+            if x.store:
+                x.store.compact()
+        return [self.files.get() for _ in range(self.files.qsize())]
+
+    def planilha(self, name, errors):
+        try:
+            self.main[name](self.files, [], 0)
+        except Exception as e:
+            errors.append(e)
+
+    def work(self, site, task):
+        try:
+            self.main['do_work_' + site](task)
+        except Exception as e:
+            print("PASS", task, e)
+
+    def resolve_one(self, site, i, name):
+        self.work(site, name)
+        with self.lock:
+            self.done[i] = self.done.get(i, 0) + 1
+            ready = self.done[i] == 2
+        if ready:
+            self.order.done(i, name)
+
+    def resolve(self):
+        with ThreadPoolExecutor(2 * self.workers) as pool:
+            for i, name in enumerate(self.main.species):
+                pool.submit(self.resolve_one, 'flora', i, name)
+                pool.submit(self.resolve_one, 'plant', i, name)
+
+    def occurrence(self, site, task):
+        self.work(site, task)
+        self.main.queue_g_s.put((site, task))
+
+    def occurrences(self, site, workers):
+        queue = self.main['queue_' + site]
+        with ThreadPoolExecutor(workers) as pool:
+            while True:
+                task = queue.get()
+                queue.task_done()
+                if task is None:
+                    break
+                pool.submit(self.occurrence, site, task)
+
+
+def check_input(file):
+    # Main only prints an input it cannot read, and the run would fail later on
+    if not Path(file).is_file():
+        sys.exit('%s: planilha de entrada não encontrada' % file)
+
+
+def run(args):
+    check_input(args.input)
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    cache = Path(args.cache or out)
+    main = Main(args.input, storage=args.storage, workers=args.workers or 1, out=out, cache=cache,
+                negative_ttl=args.negative_ttl * 24 * 3600, http_cache=args.http_cache, http_mode=args.http_mode,
+                checklist=cache / CHECKLIST if args.local_first else None, planilha=args.planilha,
+                planilha3=args.planilha3, max_records=args.max_records, correct=args.correct)
+    Scheduler(main, args.workers, args.engine).run()
+    print("%s nomes em %.1f s, %s buscas repetidas evitadas" % (len(main.species), time.time() - start, main.saved()))
+
+
+def checklist(args):
+    cache = Path(args.cache)
+    cache.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    x = Checklist(cache / CHECKLIST)
+    rows = x.import_dwca(args.source, args.file) if args.source == 'flora' else x.import_tpl(args.source, args.file)
+    print("%s nomes importados em %.1f s" % (rows, time.time() - start))
+
+
+def synonyms(args):
+    check_input(args.input)
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    main = Main(args.input, out=out, cache=args.cache or out)
+    x = main.accepted_names()
+    x.to_csv(out / 'sinonimos.csv', index=False)
+    print("%s de %s nomes são sinônimos conhecidos: %s" % (
+        int(x[['flora', 'plant']].notna().any(axis=1).sum()), len(x), out / 'sinonimos.csv'))
+
+
+def compact(args):
+    for source in ('gbif', 'splink'):
+        if (Path(args.cache) / 'occurrences' / ('source=%s' % source)).exists():
+            OccurrenceStore(args.cache, source).compact()
+
+
+def evict(args):
+    ResponseCache(args.http_cache).evict(None if args.max_mb is None else args.max_mb * 2 ** 20,
+                                         None if args.max_days is None else args.max_days * 24 * 3600)
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='macrofitas')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    x = commands.add_parser('run', help='busca todos os nomes da planilha e gera as Planilhas 1, 2 e 3')
+    x.add_argument('input', help='planilha de entrada (.xls/.xlsx), nomes na primeira coluna')
+    x.add_argument('--out', default='.', help='pasta das planilhas geradas')
+    x.add_argument('--cache', default=None, help='pasta dos resultados baixados (padrão: --out)')
+    x.add_argument('--workers', type=int, default=None,
+                   help='requisições simultâneas por site (padrão: 1, ou os limites do engine async)')
+    x.add_argument('--engine', choices=['threads', 'async'], default='threads')
+    x.add_argument('--storage', choices=['csv', 'parquet'], default='csv',
+                   help='armazenamento das ocorrências do GBIF/SpeciesLink')
+    x.add_argument('--negative-ttl', type=float, default=NEGATIVE_TTL / (24 * 3600),
+                   help='dias até buscar de novo um nome não encontrado (0 busca sempre)')
+    x.add_argument('--http-cache', default=None, help='pasta do cache das respostas brutas dos sites')
+    x.add_argument('--http-mode', choices=['record', 'replay', 'refresh'], default='record',
+                   help='replay reprocessa só a partir do cache, sem acessar a rede')
+    x.add_argument('--planilha', choices=['xlsx', 'xls'], default='xlsx',
+                   help='formato das Planilhas (xls tem no máximo 65536 linhas por aba)')
+    x.add_argument('--planilha3', choices=FORMATS, default=None,
+                   help='formato da Planilha 3, a das ocorrências (padrão: --planilha)')
+    x.add_argument('--max-records', type=int, default=None,
+                   help='máximo de ocorrências baixadas do GBIF por espécie (padrão: todas)')
+    x.add_argument('--correct', action='store_true',
+                   help='corrige de uma vez todos os nomes de entrada antes das buscas (com vários processos)')
+    x.add_argument('--local-first', action='store_true',
+                   help='resolve os nomes pelas checklists importadas (comando checklist), a rede só se faltar')
+    x.set_defaults(func=run)
+
+    x = commands.add_parser('checklist', help='importa a exportação de uma checklist para as buscas locais')
+    x.add_argument('source', choices=['flora', 'plant'])
+    x.add_argument('file', help='Darwin Core archive do IPT da Flora do Brasil (zip ou pasta) ou csv do The Plant List')
+    x.add_argument('--cache', default='.', help='pasta dos resultados baixados (a mesma do run)')
+    x.set_defaults(func=checklist)
+
+    x = commands.add_parser('sinonimos', help='nome aceito de cada nome da planilha já visto como sinônimo, sem buscas')
+    x.add_argument('input', help='planilha de entrada (.xls/.xlsx), nomes na primeira coluna')
+    x.add_argument('--out', default='.', help='pasta do sinonimos.csv')
+    x.add_argument('--cache', default=None, help='pasta dos resultados baixados (padrão: --out)')
+    x.set_defaults(func=synonyms)
+
+    x = commands.add_parser('compact', help='junta os arquivos Parquet das ocorrências, um por gênero')
+    x.add_argument('cache', help='pasta dos resultados baixados (a --cache do run com --storage parquet)')
+    x.set_defaults(func=compact)
+
+    x = commands.add_parser('evict', help='limpa o cache das respostas brutas')
+    x.add_argument('http_cache')
+    x.add_argument('--max-mb', type=float, default=None)
+    x.add_argument('--max-days', type=float, default=None)
+    x.set_defaults(func=evict)
+    return parser
+
+
+if __name__ == '__main__':
+    args = parser().parse_args()
+    args.func(args)
@@ -15,7 +15,7 @@ import main
 
 from main import Main
 
-stop_event = threading.Event()
+stop_event = main.stop_event
 
 
 class GuiPart:
@@ -156,7 +156,7 @@ class ThreadedClient:
         Check every 100 ms if there is something new in the queue.
         """
 
-        if self.len_n_flora_plant < self.plant['value'] and \
+        while self.len_n_flora_plant < self.plant['value'] and \
                 self.len_n_flora_plant < self.flora['value'] and \
                 self.len_n_flora_plant < len(self.main.species):
             self.main.queue_planilha_1.put(self.main.species[self.len_n_flora_plant])
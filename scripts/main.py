@@ -1,29 +1,59 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
-import sys
 import threading
 from pathlib import Path
 from queue import Queue
-from tkinter import Tk, Label, Frame, TOP, Scrollbar, RIGHT, Y, Listbox, SINGLE, LEFT, END, BOTTOM, filedialog
-from tkinter.ttk import Progressbar
 
 import pandas as pd
-import xlwt
 
-import macrofitas_GUI
+from checklist import Checklist
 from FloraBrasil import FloraBrasil
-from GBIF import GBIF
-from SpeciesLink import SpeciesLink
+from flight import SingleFlight
+from project import Project
+from GBIF import GBIF, FANOUT
+import names
+from SpeciesLink import SpeciesLink, FANOUT as SPLINK_FANOUT
 from ThePlantList import ThePlantList
+from session import ResponseCache, make_session
+from sheets import Formula, open_book
+from store import NEGATIVE_TTL
+
+stop_event = threading.Event()
+
+PLANILHA_3 = ['Nome Entrada', 'Família', 'Filo', 'Ordem', 'Gênero', 'Classe', 'Espécie', 'Coletor', 'País',
+              'Latitude', 'Longitude']
+# column of the occurrences of each site that goes to each column of Planilha 3 (a list is joined with spaces)
+PARAMS = {
+    'gbif': ['Nome Entrada', 'family', 'phylum', 'order', 'genus', 'class', 'species', 'recordedBy', 'country',
+             'decimalLatitude', 'decimalLongitude'],
+    'splink': ['Nome Entrada', 'tF', 'tP', 'tO', 'tGa', 'tC', ['tGa', 'tEa'], 'cL', 'lC', 'lA', 'lO']}
+
+
+def planilha_3(site, task, x):
+    """Planilha 3 rows of the occurrences `x` of one name, projected column by column."""
+    out = {'Nome Entrada': pd.Series(task, index=x.index, dtype=object)}
+    for name, column in zip(PLANILHA_3[1:], PARAMS[site][1:]):
+        if isinstance(column, str):
+            out[name] = x[column] if column in x.columns else None
+        elif all(y in x.columns for y in column):
+            parts = [x[y].astype(object).where(x[y].notna(), '').astype(str) for y in column]
+            joined = parts[0].str.cat(parts[1:], sep=' ').str.strip()
+            out[name] = joined.where(joined != '', None)
+        else:
+            out[name] = None
+    return pd.DataFrame(out, index=x.index, columns=PLANILHA_3)
 
 
 class Main:
-    def __init__(self, file=None):
-        self.Planilha1 = 'Planilha 1.xls'
-        self.Planilha2 = 'Planilha 2.xls'
-        self.Planilha3 = 'Planilha 3.xls'
+    def __init__(self, file=None, storage='csv', workers=1, out=Path('.'), cache=Path('.'), negative_ttl=NEGATIVE_TTL,
+                 http_cache=None, http_mode='record', checklist=None, planilha='xlsx', planilha3=None,
+                 max_records=None, correct=False):
+        out = Path(out)
+        # xlsx/xls for the Planilhas; Planilha 3, with every occurrence, can also be csv/parquet
+        self.Planilha1 = str(out / ('Planilha 1.' + planilha))
+        self.Planilha2 = str(out / ('Planilha 2.' + planilha))
+        self.Planilha3 = str(out / ('Planilha 3.' + (planilha3 or planilha)))
         self.itens = []
 
         self.f_plant = True
@@ -39,6 +69,8 @@ class Main:
         self.n_splink_max = 0
         self.n_flora_max = 0
         self.n_gbif_max = 0
+        # the same name is often queued more than once (synonyms of one accepted name)
+        self.flights = {site: SingleFlight() for site in ('flora', 'plant', 'gbif', 'splink')}
         try:
 
             file_input = Path(file)
@@ -47,6 +79,10 @@ class Main:
             self.species = column_data.parse(column_data.sheet_names[0])
             head = self.species.columns.values.tolist()
             self.species = head[:1] + list(self.species[head[0]])
+            if correct:
+                # each distinct name is corrected once, in a batch, and the sources only hit the
+                # memo; otherwise a name is corrected when a search for it fails
+                Project().correct_names(self.species)
             self.queue_plant = Queue()
             self.queue_flora = Queue()
             self.queue_splink = Queue()
@@ -63,11 +99,19 @@ class Main:
                 # self.queue_splink.put(i)
 
             # path = file_input.parent
-            path = Path('.')
-            self.florabrasil = FloraBrasil(path=path)
-            self.theplantlist = ThePlantList(path=path)
-            self.splink = SpeciesLink(path=path)
-            self.gbif = GBIF(path=path)
+            path = Path(cache)
+            http_cache = ResponseCache(http_cache, http_mode) if http_cache else None
+            # local-first: names in the imported checklists are resolved without the sites
+            checklist = Checklist(checklist) if checklist else None
+            self.florabrasil = FloraBrasil(path=path, session=make_session(workers, cache=http_cache),
+                                           negative_ttl=negative_ttl, checklist=checklist)
+            self.theplantlist = ThePlantList(path=path, session=make_session(workers, cache=http_cache),
+                                             negative_ttl=negative_ttl, checklist=checklist)
+            self.splink = SpeciesLink(path=path, storage=storage,
+                                      session=make_session(workers * SPLINK_FANOUT, cache=http_cache),
+                                      negative_ttl=negative_ttl)
+            self.gbif = GBIF(path=path, storage=storage, session=make_session(workers * FANOUT, cache=http_cache),
+                             negative_ttl=negative_ttl, max_records=max_records)
             self.task_done = False
             self.task_occorence_done = False
         except OSError as e:
@@ -85,17 +129,30 @@ class Main:
     def get_(self, name, max=False):
         return getattr(self, name + "_max" if max else "")
 
+    def accepted_names(self):
+        """Accepted name of every input name already known as a synonym, by source, without any request."""
+        return pd.DataFrame({'Nome Entrada': self.species,
+                             'flora': self.florabrasil.synonyms.resolve(self.species),
+                             'plant': self.theplantlist.synonyms.resolve(self.species)})
+
+    def saved(self):
+        return sum(x.saved for x in self.flights.values())
+
     def do_work_flora(self, query):
-        self.florabrasil.run(query)
+        key = names.author_key(query)
+        self.flights['flora'].do(key, self.florabrasil.run, query)
+        # run only prints a network error: a name neither written nor known as not found is tried again
+        if query not in self.florabrasil.index and not self.florabrasil.negative.get(key):
+            self.flights['flora'].forget(key)
 
     def do_work_gbif(self, query):
-        self.gbif.run(query, False)
+        self.flights['gbif'].do(names.key(query), self.gbif.run, query, False)
 
     def do_work_plant(self, query):
-        self.theplantlist.run(query)
+        self.flights['plant'].do(names.author_key(query), self.theplantlist.run, query)
 
     def do_work_splink(self, query):
-        self.splink.run(query, False)
+        self.flights['splink'].do(self.splink.key(query), self.splink.run, query, False)
 
     def run_(self, site, queue, thread_list, index):
         while not self.task_done:
@@ -106,7 +163,7 @@ class Main:
                 self['queue_' + site].task_done()
             except:
                 print("PASS", task)
-            if macrofitas_GUI.stop_event.is_set():
+            if stop_event.is_set():
                 exit(1)
 
     def run_occorence_(self, site, queue, thread_list, index):
@@ -120,177 +177,126 @@ class Main:
                 print("PASS", task)
 
             self.queue_g_s.put((site, task))
-            if macrofitas_GUI.stop_event.is_set():
+            if stop_event.is_set():
                 exit(1)
 
+    def book(self, path, queue):
+        """
+        open_book(path) for the Planilha that consumes `queue`. When it fails,
+        the items of the queue are still taken, up to the None that ends it,
+        so nothing joined on the queue waits forever for a dead writer.
+        """
+        try:
+            return open_book(path)
+        except Exception as e:
+            print('%s: %s' % (path, e))
+            while queue.get() is not None:
+                queue.task_done()
+            queue.task_done()
+            raise
+
+    def save(self, book, files):
+        book.close()
+        for x in book.files:
+            files.put(str(x))
+            print("File Save: %s" % x)
+
     def Planilha_3(self, files, thread_list, index):
-        book = xlwt.Workbook()
-        sheet1 = book.add_sheet("Planilha 3")
-        sheet12 = book.add_sheet("Planilha 3 Não encontrados")
-        header = ['Nome Entrada', 'Família', 'Filo', 'Ordem', 'Gênero', 'Classe', 'Espécie', 'Coletor', 'País',
-                  'Latitude', 'Longitude']
-        for i in range(len(header)):
-            sheet1.write(0, i, header[i])
-        k = 1
-        kn = 0
-
-        params = {
-            'gbif': ['Nome Entrada', 'family', 'phylum', 'order', 'genus', 'class', 'species', 'recordedBy', 'country',
-                     'decimalLatitude', 'decimalLongitude'],
-            'splink': ['Nome Entrada', 'tF', 'tP', 'tO', 'tGa', 'tC', ['tGa', 'tEa'], 'cL', 'lC', 'lA', 'lO']}
+        book = self.book(self.Planilha3, self.queue_g_s)
+        sheet1 = book.sheet("Planilha 3", PLANILHA_3, numeric=['Latitude', 'Longitude'])
+        sheet12 = book.sheet("Planilha 3 Não encontrados", ['Site', 'Nome Entrada'])
         while not self.task_occorence_done:
-            (site, task) = self.queue_g_s.get()
+            item = self.queue_g_s.get()
+            if item is None:
+                self.queue_g_s.task_done()
+                break
+            (site, task) = item
             try:
                 x = getattr(self, site)._get(task)
                 if not isinstance(x, pd.DataFrame):
-                    try:
-                        sheet12.write(kn, 0, site)
-                        sheet12.write(kn, 1, task)
-                        kn += 1
-                    except:
-                        pass
-                else:
-                    for i in range(len(x)):
-                        try:
-                            sheet1.write(k, 0, task)
-                            row = x.loc[i]
-                            row_header = params.get(site, [])
-                            for j in range(1, len(row_header)):
-                                if type(row_header[j]) == type(''):
-                                    if row_header[j] in row.keys().tolist():
-                                        if row[row_header[j]] == row[row_header[j]]:
-                                            sheet1.write(k, j, row[row_header[j]])
-                                else:
-                                    sheet1.write(k, j, str(row[row_header[j][0]]) + ' ' + str(row[row_header[j][1]]))
-                            k += 1
-                        except:
-                            pass
-            except:
-                print('Planilha 3')
+                    sheet12.append([site, task])
+                elif site in PARAMS:
+                    sheet1.append_frame(planilha_3(site, task, x))
+            except Exception as e:
+                print('Planilha 3: %s %s: %s' % (site, task, e))
             self.queue_g_s.task_done()
-            if macrofitas_GUI.stop_event.is_set():
+            if stop_event.is_set():
                 break
 
-        book.save(self.Planilha3)
-        files.put(self.Planilha3)
-        print("File Save: %s" % self.Planilha3)
+        self.save(book, files)
 
     def Planilha_2(self, files, thread_list, index):
-        book2 = xlwt.Workbook()
-        sheet2 = book2.add_sheet("Planilha 2")
-        sheet22 = book2.add_sheet("Planilha 2 Não encontrados")
+        book2 = self.book(self.Planilha2, self.queue_planilha_2)
         header2 = ['Nome Entrada', 'family', 'genus', 'scientificname', 'scientificnameauthorship', 'taxonomicstatus',
                    'formaVida', 'substrato', 'tipoVegetacao', 'origem', 'sinonimos']
-
-        for i in range(len(header2)):
-            sheet2.write(0, i, header2[i])
-        sheet22.write(0, 0, 'Não encontrados')
-        k = 1
-        t = 1
+        sheet2 = book2.sheet("Planilha 2", header2)
+        sheet22 = book2.sheet("Planilha 2 Não encontrados", ['Não encontrados'])
         while not self.task_done:
             is_find_flora = False
             is_find_plant = False
             task = self.queue_planilha_2.get()
+            if task is None:
+                self.queue_planilha_2.task_done()
+                break
+            row = [task] + [None] * (len(header2) - 1)
             try:
-                sheet2.write(k, 0, task)
                 flora = self.florabrasil._get(task)
                 if not isinstance(flora, pd.DataFrame):
-                    self.florabrasil.run(task)
+                    self.do_work_flora(task)
                     flora = self.florabrasil._get(task)
 
                 if isinstance(flora, pd.DataFrame) and flora['taxonomicstatus'][0] == 'NOME_ACEITO':
-                    if 'family' in flora.columns.values.tolist() and flora['family'][0] == flora['family'][0]:
-                        sheet2.write(k, 1, flora['family'][0])
-
-                    if 'genus' in flora.columns.values.tolist() and flora['genus'][0] == flora['genus'][0]:
-                        sheet2.write(k, 2, flora['genus'][0])
-
-                    if 'scientificname' in flora.columns.values.tolist() and flora['scientificname'][0] == \
-                            flora['scientificname'][0]:
-                        sheet2.write(k, 3, flora['scientificname'][0])
-
-                    if 'scientificnameauthorship' in flora.columns.values.tolist() and \
-                            flora['scientificnameauthorship'][0] == flora['scientificnameauthorship'][0]:
-                        sheet2.write(k, 4, flora['scientificnameauthorship'][0])
-
-                    if 'taxonomicstatus' in flora.columns.values.tolist():
-                        sheet2.write(k, 5, "Aceito" if flora['taxonomicstatus'][0] == 'NOME_ACEITO' else "Sinonimo")
-
-                    if 'formaVida' in flora.columns.values.tolist() and flora['formaVida'][0] == flora['formaVida'][0]:
-                        sheet2.write(k, 6, flora['formaVida'][0])
-
-                    if 'substrato' in flora.columns.values.tolist() and flora['substrato'][0] == flora['substrato'][0]:
-                        sheet2.write(k, 7, flora['substrato'][0])
-
-                    if 'tipoVegetacao' in flora.columns.values.tolist() and flora['tipoVegetacao'][0] == \
-                            flora['tipoVegetacao'][0]:
-                        sheet2.write(k, 8, flora['tipoVegetacao'][0])
-
-                    if 'origem' in flora.columns.values.tolist() and flora['origem'][0] == flora['origem'][0]:
-                        sheet2.write(k, 9, flora['origem'][0])
-
-                    if 'sinonimos' in flora.columns.values.tolist() and flora['sinonimos'][0] == flora['sinonimos'][0]:
-                        sheet2.write(k, 10, flora['sinonimos'][0])
+                    for j, column in enumerate(header2):
+                        if j and column in flora.columns:
+                            row[j] = flora[column][0]
+                    row[5] = "Aceito" if flora['taxonomicstatus'][0] == 'NOME_ACEITO' else "Sinonimo"
                     is_find_flora = True
 
                 plant = self.theplantlist._get(task)
                 if not isinstance(plant, pd.DataFrame):
-                    self.theplantlist.run(task)
+                    self.do_work_plant(task)
                     plant = self.theplantlist._get(task)
 
                 if isinstance(plant, pd.DataFrame) and not is_find_flora and plant['status'][0] == 'accepted':
-                    if 'scientificname' in plant.columns.values.tolist():
-                        sheet2.write(k, 3, plant['scientificname'][0])
-                    if 'scientificnameauthorship' in plant.columns.values.tolist():
-                        sheet2.write(k, 4, plant['scientificnameauthorship'][0])
-                    if 'status' in plant.columns.values.tolist():
-                        sheet2.write(k, 5, "Aceito" if plant['status'][0] == 'accepted' else "Sinonimo")
-                    if 'sinonimos' in plant.columns.values.tolist():
-                        sheet2.write(k, 10, plant['sinonimos'][0])
+                    for j, column in ((3, 'scientificname'), (4, 'scientificnameauthorship'), (10, 'sinonimos')):
+                        if column in plant.columns:
+                            row[j] = plant[column][0]
+                    row[5] = "Aceito" if plant['status'][0] == 'accepted' else "Sinonimo"
                     is_find_plant = True
 
                 if not is_find_flora and not is_find_plant:
-                    sheet22.write(t, 0, task)
-                    t += 1
-            except:
-                print("Planilha 2")
+                    sheet22.append([task])
+            except Exception as e:
+                print("Planilha 2: %s: %s" % (task, e))
+            sheet2.append(row)
             self.queue_planilha_2.task_done()
-
-            k += 1
-            if macrofitas_GUI.stop_event.is_set(): break
-        # Save the workbook
-        book2.save(self.Planilha2)
-        files.put(self.Planilha2)
-        print("File Save: %s" % self.Planilha2)
+            if stop_event.is_set(): break
+        self.save(book2, files)
 
     def Planilha_1(self, files, thread_list, index):
-        # Initialize a workbook
-        book = xlwt.Workbook()
-        # Add a sheet to the workbook
-        sheet1 = book.add_sheet("Planilha 1")
-        sheet12 = book.add_sheet("Planilha 1 Não encontrados")
-
+        book = self.book(self.Planilha1, self.queue_planilha_1)
         header = ['Nome Entrada', 'plant status', 'plant nome', 'flora status', 'flora nome', 'Flora x Plant']
-        # Write to the sheet of the workbook
-        for i in range(len(header)):
-            sheet1.write(0, i, header[i])
-        sheet12.write(0, 0, 'Não encontrados')
-        k = 1
-        t = 1
+        sheet1 = book.sheet("Planilha 1", header)
+        sheet12 = book.sheet("Planilha 1 Não encontrados", ['Não encontrados'])
+        compare = Formula('IF(AND(B{row} = "";D{row} = "");"";IF(AND(B{row}=D{row}; C{row} = E{row}) ;"Igual";'
+                          '"Diferente"))')
         while not self.task_done:
             is_find_flora = False
             is_find_plant = False
 
             task = self.queue_planilha_1.get()
+            if task is None:
+                self.queue_planilha_1.task_done()
+                break
+            row = [task, None, None, None, None, compare]
             try:
-                sheet1.write(k, 0, task)
                 flora = self.florabrasil._get(task)
 
                 if isinstance(flora, pd.DataFrame):
-                    sheet1.write(k, 3, "Aceito" if flora['taxonomicstatus'][0] == 'NOME_ACEITO' else "Sinonimo")
+                    row[3] = "Aceito" if flora['taxonomicstatus'][0] == 'NOME_ACEITO' else "Sinonimo"
                     name = flora['scientificname'][0] if flora['taxonomicstatus'][0] == 'NOME_ACEITO' else \
                         flora['acceptednameusage'][0]
-                    sheet1.write(k, 4, name)
+                    row[4] = name
 
                     self.queue_gbif.put(name)
                     self.queue_splink.put(name)
@@ -300,10 +306,10 @@ class Main:
 
                 plant = self.theplantlist._get(task)
                 if isinstance(plant, pd.DataFrame):
-                    sheet1.write(k, 1, "Aceito" if plant['status'][0] == 'accepted' else "Sinonimo")
+                    row[1] = "Aceito" if plant['status'][0] == 'accepted' else "Sinonimo"
                     name = plant['scientificname'][0] if plant['status'][0] == 'accepted' else \
                         plant['acceptednameusage'][0]
-                    sheet1.write(k, 2, name)
+                    row[2] = name
 
                     if not is_find_flora:
                         self.queue_gbif.put(name)
@@ -311,24 +317,14 @@ class Main:
                         self.queue_planilha_2.put(name)
 
                     is_find_plant = True
-                sheet1.write(k, 5, xlwt.Formula(
-                    'IF(AND(B%s = "",D%s = "");"";IF(AND(B%s=D%s, C%s = E%s) ;"Igual";"Diferente"))' % (
-                        k + 1, k + 1, k + 1, k + 1, k + 1, k + 1)))
 
                 if not is_find_plant:
-                    sheet12.write(t, 0, 'ThePlantList')
-                    sheet12.write(t, 1, task)
-                    t += 1
+                    sheet12.append(['ThePlantList', task])
                 if not is_find_flora:
-                    sheet12.write(t, 0, 'FloraBrasil')
-                    sheet12.write(t, 1, task)
-                    t += 1
-            except:
-                print("Planilha 1")
-            k += 1
+                    sheet12.append(['FloraBrasil', task])
+            except Exception as e:
+                print("Planilha 1: %s: %s" % (task, e))
+            sheet1.append(row)
             self.queue_planilha_1.task_done()
-            if macrofitas_GUI.stop_event.is_set(): break
-        # Save the workbook
-        book.save(self.Planilha1)
-        files.put(self.Planilha1)
-        print("File Save: %s" % self.Planilha1)
+            if stop_event.is_set(): break
+        self.save(book, files)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Two-stage fuzzy matching of scientific names: the genus is matched against
+the genera of a species list, and the epithet only against the epithets of
+the genera found. Each stage is a small symmetric delete index (a SymSpell
+with just those words), so a lookup only compares a handful of candidates.
+The authorship is not matched, it is kept as it was written.
+"""
+from pathlib import Path
+
+from symspellpy import SymSpell, Verbosity
+
+from names import split_name
+
+
+def index(words, max_distance):
+    sym_spell = SymSpell(max_dictionary_edit_distance=max_distance, prefix_length=7)
+    for word, count in words:
+        sym_spell.create_dictionary_entry(word, count)
+    return sym_spell
+
+
+class Matcher:
+    """
+    Fuzzy matcher over a list of species names: match('Eichornia crasipes Mart.')
+    gives 'Eichhornia crassipes Mart.'.
+    """
+
+    def __init__(self, names=(), max_distance=2):
+        self.max_distance = max_distance
+        self.epithets = {}
+        for name in names:
+            genus, epithet, _, _ = split_name(name)
+            if genus and epithet:
+                self.epithets.setdefault(genus, set()).add(epithet)
+        # genera with more species win the ties
+        self.genera = index(((x, len(y)) for x, y in self.epithets.items()), max_distance)
+        self.indexes = {}
+
+    @classmethod
+    def load(cls, file):
+        with Path(file).open('r', encoding='utf-8') as f:
+            return cls(line.strip() for line in f)
+
+    def __len__(self):
+        return len(self.epithets)
+
+    def species(self, genus):
+        # the epithet indexes are only built for the genera that are looked up
+        x = self.indexes.get(genus)
+        if x is None:
+            x = self.indexes[genus] = index(((y, 1) for y in sorted(self.epithets[genus])), self.max_distance)
+        return x
+
+    def match(self, name, max_distance=None):
+        """Closest species of the list (genus + epithet distance), with the authorship of name, or None."""
+        max_distance = self.max_distance if max_distance is None else max_distance
+        genus, epithet, infra, authorship = split_name(name)
+        if not genus or not epithet:
+            return None
+        best = None
+        for x in self.genera.lookup(genus, Verbosity.ALL, max_distance):
+            if best and x.distance >= best[0]:
+                break
+            found = self.species(x.term).lookup(epithet, Verbosity.CLOSEST, max_distance - x.distance)
+            if found and (best is None or x.distance + found[0].distance < best[0]):
+                best = (x.distance + found[0].distance, x.term, found[0].term)
+        if best is None:
+            return None
+        return ' '.join(x for x in (best[1], best[2], infra, authorship) if x)
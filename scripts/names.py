@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Normalization of scientific names, for the cache keys of every source:
+'Lemna gibba L.', 'Lemna  gibba' and 'lemna gibba' are all 'Lemna gibba'.
+
+    key('Eichhornia crassipes (Mart.) Solms')  -> 'Eichhornia crassipes'
+    key('Nymphaea ampla ssp. pulchella DC.')   -> 'Nymphaea ampla subsp. pulchella'
+    species('Nymphaea ampla var. pulchella')   -> 'Nymphaea ampla'
+    species('Lemna L.')                        -> 'Lemna L.'
+    key('Nymphaea × thiona')                   -> 'Nymphaea x thiona'
+    key('Justicia sp.')                        -> 'Justicia sp.'
+    author_key('Hydrocotyle umbellata Vell.')  -> 'Hydrocotyle umbellata vell'
+"""
+import hashlib
+import re
+from functools import lru_cache
+
+# infraspecific ranks as written -> as kept in the keys
+RANKS = {'subsp.': 'subsp.', 'subsp': 'subsp.', 'ssp.': 'subsp.', 'ssp': 'subsp.', 'var.': 'var.', 'var': 'var.',
+         'f.': 'f.', 'fo.': 'f.', 'forma': 'f.', 'subvar.': 'subvar.'}
+# the species of the genus is not known: not an epithet
+UNKNOWN = {'sp': 'sp.', 'sp.': 'sp.', 'spp': 'spp.', 'spp.': 'spp.'}
+HYBRID = ('x', '×')
+
+# characters kept in file names, the others are replaced and the name gets a hash
+UNSAFE = re.compile(r'[^\w .()&,-]')
+MAX_FILENAME = 100
+
+
+def fold(name):
+    """Name with the whitespace collapsed."""
+    return ' '.join(str(name).split())
+
+
+def split_name(name):
+    """
+    (genus, epithet, infraspecific, authorship) of a name, e.g.
+    'Eichhornia crassipes (Mart.) Solms' -> ('Eichhornia', 'crassipes', '', '(Mart.) Solms').
+    A second word in capitals is still the epithet ('Lemna Gibba'), unless it
+    looks like an author (a '.', '(' or '&' in it); the epithet of a hybrid
+    keeps its marker as 'x' ('Nymphaea × thiona' -> 'x thiona').
+    """
+    words = str(name).split()
+    if len(words) > 1 and words[1][:1] in HYBRID and words[1][1:].isalpha():
+        # Nymphaea ×thiona
+        words = words[:1] + ['x', words[1][1:]] + words[2:]
+    genus = words[0].capitalize() if words else ''
+    hybrid = len(words) > 2 and words[1].lower() in HYBRID
+    if hybrid:
+        words = words[:1] + words[2:]
+    epithet = words[1].lower() if len(words) > 1 and words[1].replace('-', '').isalpha() \
+        and words[1].lower() not in UNKNOWN else ''
+    rest = words[2:] if epithet else words[1:]
+    if epithet and hybrid:
+        epithet = 'x ' + epithet
+    elif hybrid:
+        rest = ['x'] + rest
+    if rest and rest[0].lower() in UNKNOWN:
+        rest = [UNKNOWN[rest[0].lower()]] + rest[1:]
+    infra = ''
+    if len(rest) > 1 and rest[0].lower() in RANKS and rest[1][:1].islower():
+        infra = '%s %s' % (RANKS[rest[0].lower()], rest[1].lower())
+        rest = rest[2:]
+    return genus, epithet, infra, ' '.join(rest)
+
+
+@lru_cache(maxsize=100000)
+def key(name):
+    """
+    Cache key of a name: genus, epithet and infraspecific rank and epithet,
+    without the authorship. A name with no epithet keeps the rest ('Justicia
+    sp.'), only the genus alone gives the genus.
+    """
+    genus, epithet, infra, rest = split_name(name)
+    if not epithet and rest:
+        return '%s %s' % (genus, rest)
+    return ' '.join(x for x in (genus, epithet, infra) if x)
+
+
+def authorship(name):
+    """Authorship of a name as compared: 'Vell.' and 'vell' are the same author."""
+    return ''.join(split_name(name)[3].split()).replace('.', '').lower()
+
+
+@lru_cache(maxsize=100000)
+def author_key(name):
+    """
+    key() with the authorship as compared by authorship(), for the sources
+    whose results are names: 'Hydrocotyle umbellata Vell.' and 'Hydrocotyle
+    umbellata L.' are two taxa, 'Lemna gibba L.' and 'lemna  gibba l' one.
+    """
+    genus, epithet, _, _ = split_name(name)
+    author = authorship(name)
+    if not epithet or not author:
+        # with no epithet the rest is already in key()
+        return key(name)
+    return '%s %s' % (key(name), author)
+
+
+def species(name):
+    """
+    Genus and epithet only (what SpeciesLink searches). As in key(), a name
+    with no epithet keeps the rest, so 'Justicia sp.' is not the genus.
+    """
+    genus, epithet, _, rest = split_name(name)
+    if not epithet and rest:
+        return '%s %s' % (genus, rest)
+    return ' '.join(x for x in (genus, epithet) if x)
+
+
+def genus_only(name):
+    """True for a name with more than the genus but no epithet ('Justicia sp.', 'Lemna L.')."""
+    genus, epithet, _, rest = split_name(name)
+    return not epithet and bool(rest)
+
+
+def filename(name, key=key):
+    """File name (without extension) of the results of a name, safe on any filesystem."""
+    x = key(name)
+    safe = UNSAFE.sub('_', x).strip(' .')
+    if safe != x or not safe or len(safe) > MAX_FILENAME:
+        safe = '%s-%s' % (safe[:MAX_FILENAME], hashlib.sha1(x.encode('utf-8')).hexdigest()[:10])
+    return safe
+
+
+def name_key(name):
+    """Exact key of a name, authorship included."""
+    return fold(name).lower()
+
+
+def canonical_key(genus, epithet, infra=''):
+    return ' '.join(x for x in (genus, epithet, infra) if x).lower()
+
+
+def query_keys(query):
+    """(exact, canonical) keys of an input name."""
+    genus, epithet, infra, rest = split_name(query)
+    if not epithet and rest:
+        # 'Justicia sp.' is not the genus
+        return name_key(query), name_key(key(query))
+    return name_key(query), canonical_key(genus, epithet, infra.split(' ')[-1] if infra else '')
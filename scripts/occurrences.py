@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import atexit
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import pandas as pd
+
+from store import Store
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# typed columns, everything else is kept as text
+DTYPES = {
+    'decimalLatitude': 'float64',
+    'decimalLongitude': 'float64',
+    'year': 'Int32',
+    'month': 'Int32',
+    # SpeciesLink
+    'lA': 'float64',
+    'lO': 'float64',
+}
+
+# the SpeciesLink coordinates are text, e.g. '-46.1 & ' when a record has more than one
+NUMBER = r'(-?\d+(?:\.\d+)?)'
+
+
+def numeric(values, dtype):
+    x = pd.Series(values, dtype=object)
+    number = pd.to_numeric(x, errors='coerce')
+    text = x[number.isna() & x.notna()]
+    if len(text):
+        number[text.index] = pd.to_numeric(text.astype(str).str.extract(NUMBER)[0], errors='coerce')
+    return number.astype(dtype)
+
+
+def to_frame(records, columns=None):
+    """
+    One DataFrame from a list of record dicts, built column by column with
+    explicit dtypes, instead of a frame per record glued with pd.concat.
+    """
+    if columns is None:
+        columns = list(dict.fromkeys(key for record in records for key in record))
+    frame = pd.DataFrame({column: numeric([record.get(column) for record in records], DTYPES[column])
+                          if column in DTYPES else pd.array([record.get(column) for record in records], dtype=object)
+                          for column in columns}, columns=columns)
+    return frame
+
+
+def typed(frame):
+    frame = frame.copy()
+    for column in frame.columns:
+        if column in DTYPES:
+            frame[column] = numeric(frame[column].values, DTYPES[column]).values
+        else:
+            frame[column] = frame[column].astype('string')
+    return frame
+
+
+def fetch_pages(fetch, offsets, fanout):
+    """
+    (offset, fetch(offset)) of every offset, in order, with at most `fanout`
+    pages in flight. Pages not yet fetched are cancelled when the consumer
+    stops early (an error, or a page that ends the result).
+    """
+    offsets = iter(offsets)
+    with ThreadPoolExecutor(fanout) as pool:
+        window = deque((x, pool.submit(fetch, x)) for x in islice(offsets, fanout))
+        try:
+            while window:
+                offset, future = window.popleft()
+                page = future.result()
+                following = next(offsets, None)
+                if following is not None:
+                    window.append((following, pool.submit(fetch, following)))
+                yield offset, page
+        finally:
+            for _, future in window:
+                future.cancel()
+
+
+def write_csv(frames, save_as):
+    """
+    Writes the frames (one per page) to save_as as they arrive, so memory
+    does not grow with the number of records. A column first seen on a later
+    page is appended to the end of the header, and the earlier rows just end
+    before it, which pd.read_csv reads back as NaN. The rows go to a temporary
+    file, and save_as is only replaced once every page has been written; if a
+    page raises, the temporary files are removed and save_as is left as it was.
+    """
+    save_as = Path(save_as)
+    body = save_as.with_name(save_as.name + '.body.tmp')
+    temp = save_as.with_name(save_as.name + '.tmp')
+    columns = []
+    rows = 0
+    try:
+        with body.open('w', encoding='utf-8', newline='') as f:
+            for frame in frames:
+                columns += [x for x in frame.columns if x not in columns]
+                frame.reindex(columns=columns).to_csv(f, header=False, index=False)
+                rows += len(frame)
+        if not rows:
+            return 0
+        with temp.open('w', encoding='utf-8', newline='') as f:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+            with body.open('r', encoding='utf-8', newline='') as b:
+                shutil.copyfileobj(b, f)
+        os.replace(str(temp), str(save_as))
+        return rows
+    finally:
+        for x in (body, temp):
+            if x.exists():
+                x.unlink()
+
+
+class OccurrenceStore:
+    """
+    Occurrences of every species of one source kept in a single Parquet
+    dataset, partitioned as occurrences/source=<source>/genus=<genus>.
+    Appends of every species are buffered together and flushed in batches, so
+    a run writes a handful of files per genus instead of one CSV per species.
+    A species is in names once its batch is on disk; until then it is pending,
+    and read() takes it from the buffer.
+    """
+
+    def __init__(self, path=Path('.'), source='gbif', flush_rows=100000):
+        if pa is None or int(pa.__version__.split('.')[0]) < 14:
+            # concat_tables(promote_options=) and drop_columns
+            raise ImportError('pyarrow>=14 is required for the parquet storage')
+        self.source = source
+        self.root = Path(path) / 'occurrences'
+        self.folder = self.root / ('source=%s' % source)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        # query -> [genus, version]; only rows of the latest version are read back
+        self.names = Store(self.root / 'names.db', source)
+        self.flush_rows = flush_rows
+        self.buffer = {}
+        self.rows = 0
+        # query -> [genus, version] of the species whose last page is in the buffer
+        self.pending = {}
+        # genus -> (files, unified schema), so a read does not open every footer of the partition
+        self.schemas = {}
+        self.lock = threading.RLock()
+        atexit.register(self.flush)
+
+    def __contains__(self, query):
+        with self.lock:
+            return query in self.pending or query in self.names
+
+    def latest(self, query):
+        """[genus, version] of the rows of query that are read back, or None."""
+        with self.lock:
+            return self.pending.get(query) or self.names.get(query)
+
+    def genus(self, query):
+        genus = query.split(' ')[0] if query else ''
+        return re.sub(r'[^\w-]', '_', genus) or '_'
+
+    def append(self, query, frame):
+        return self.append_pages(query, [frame])
+
+    def append_pages(self, query, frames):
+        """
+        Appends the pages of one species as they arrive; the buffer is flushed
+        whenever it gets to flush_rows, so memory stays bounded. The new version
+        is only visible to read() once the last page is in, and only published
+        in names once it is on disk.
+        """
+        genus = self.genus(query)
+        version = int(time.time() * 1000)
+        rows = 0
+        for frame in frames:
+            if not len(frame):
+                continue
+            frame = typed(frame)
+            frame['query'] = pd.Series([query] * len(frame), dtype='string', index=frame.index)
+            frame['version'] = pd.Series([version] * len(frame), dtype='int64', index=frame.index)
+            rows += len(frame)
+            with self.lock:
+                self.buffer.setdefault(genus, []).append(frame)
+                self.rows += len(frame)
+                if self.rows >= self.flush_rows:
+                    self.flush()
+        if rows:
+            with self.lock:
+                self.pending[query] = [genus, version]
+        return rows
+
+    def flush(self):
+        with self.lock:
+            for genus, frames in self.buffer.items():
+                self._write(genus, pd.concat(frames, sort=False))
+            self.buffer = {}
+            self.rows = 0
+            # on disk now: a species in names is never only in memory
+            for query, item in self.pending.items():
+                self.names.put(query, item)
+            self.pending = {}
+
+    def _write(self, genus, frame):
+        folder = self.folder / ('genus=%s' % genus)
+        folder.mkdir(parents=True, exist_ok=True)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        file = folder / ('%s.parquet' % uuid.uuid4().hex)
+        pq.write_table(table, file)
+        if genus in self.schemas:
+            files, schema = self.schemas[genus]
+            self.schemas[genus] = (files | {str(file)}, pa.unify_schemas([schema, table.schema]))
+
+    def _dataset(self, genus):
+        files = [str(x) for x in (self.folder / ('genus=%s' % genus)).glob('*.parquet')]
+        if not files:
+            return None
+        # the columns found for each source change from one species to the other:
+        # the footers are read once, then only those of the files written by others
+        known, schema = self.schemas.get(genus, (frozenset(), None))
+        if not known.issubset(files):
+            known, schema = frozenset(), None
+        new = [x for x in files if x not in known]
+        if new:
+            schema = pa.unify_schemas(([schema] if schema else []) + [pq.read_schema(x) for x in new])
+            self.schemas[genus] = (known | set(new), schema)
+        return ds.dataset(files, schema=schema, format='parquet')
+
+    def read(self, query):
+        item = self.latest(query)
+        if not item:
+            return None
+        genus, version = item
+        with self.lock:
+            tables = [pa.Table.from_pandas(frame, preserve_index=False) for frame in self.buffer.get(genus, [])
+                      if frame['query'].iloc[0] == query and frame['version'].iloc[0] == version]
+            dataset = self._dataset(genus)
+        if dataset is not None:
+            # pushdown: only the row groups of this species are decoded
+            tables.insert(0, dataset.to_table(filter=(ds.field('query') == query) & (ds.field('version') == version)))
+        tables = [x for x in tables if x.num_rows]
+        if not tables:
+            return None
+        table = pa.concat_tables(tables, promote_options='permissive')
+        # same plain numpy/object columns that pd.read_csv gives for the csv storage
+        frame = table.drop_columns(['query', 'version']).to_pandas(ignore_metadata=True)
+        return frame.dropna(axis=1, how='all')
+
+    def compact(self):
+        """
+        Rewrites each genus partition with more than one file as a single
+        file, dropping the rows of versions that were replaced by a later
+        download. A run with the parquet storage ends with it.
+        """
+        self.flush()
+        with self.lock:
+            latest = {(query, self.names.get(query)[1]) for query in self.names.keys()}
+            for folder in self.folder.glob('genus=*'):
+                old = list(folder.glob('*.parquet'))
+                if len(old) < 2:
+                    continue
+                dataset = self._dataset(folder.name[len('genus='):])
+                frame = dataset.to_table().to_pandas()
+                keep = [(q, v) in latest for q, v in zip(frame['query'], frame['version'])]
+                frame = frame[keep]
+                if len(frame):
+                    self._write(folder.name[len('genus='):], frame)
+                for x in old:
+                    x.unlink()
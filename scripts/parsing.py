@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+HTML of the source sites parsed with lxml. Small pages still go through
+BeautifulSoup, but only the tags that are read are built (SoupStrainer); the
+big SpeciesLink result pages are read with XPath on the lxml tree, which
+skips building a soup at all.
+
+JSON responses are decoded straight from the response bytes, with orjson
+when it is installed.
+"""
+import json
+
+import lxml.html
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PARSER = 'lxml'
+
+
+def soup(text, *names, **attrs):
+    """
+    BeautifulSoup of only the tags with one of `names` (or matching `attrs`)
+    and everything inside them, e.g. soup(text, 'h1', 'tbody').
+    """
+    only = SoupStrainer(list(names) or None, attrs=attrs) if names or attrs else None
+    return BeautifulSoup(text, PARSER, parse_only=only)
+
+
+def strip_tags(html):
+    return BeautifulSoup(html, PARSER).text
+
+
+def tree(html):
+    if isinstance(html, str):
+        # lxml refuses a str that declares its own encoding
+        html = html.encode('utf-8')
+    return lxml.html.fromstring(html, parser=lxml.html.HTMLParser(encoding='utf-8'))
+
+
+def has_class(name):
+    """XPath predicate for elements with the css class `name`."""
+    return 'contains(concat(" ", normalize-space(@class), " "), " %s ")' % name
+
+
+def _cut(x, keep):
+    if isinstance(x, dict):
+        # in the order of the document, as the object_pairs_hook of json
+        return {k: _cut(v, keep) for k, v in x.items() if k in keep}
+    if isinstance(x, list):
+        return [_cut(v, keep) for v in x]
+    return x
+
+
+def loads(content, keep=None):
+    """
+    JSON from the response bytes. With `keep`, every object is cut to the keys
+    in keep, so the fields that are never read are not kept; json does it
+    while decoding, orjson right after. keep has to list the keys of the
+    enclosing objects too, e.g. 'results'.
+    """
+    if orjson is not None:
+        data = orjson.loads(content)
+        return data if keep is None else _cut(data, keep)
+    if keep is None:
+        return json.loads(content)
+    return json.loads(content, object_pairs_hook=lambda pairs: {k: v for k, v in pairs if k in keep})
@@ -1,35 +1,221 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from symspellpy import SymSpell
+
+from matcher import Matcher
+from store import Store
+
+DICTIONARY = Path('dict_final.txt')
+# species list next to the dictionary, one name per line (Dict_SymSpell.py --species)
+SPECIES = 'species.txt'
+MAX_EDIT_DISTANCE = 2
+PREFIX_LENGTH = 7
+# corrections kept between runs, the least recently used are dropped
+MEMO_SIZE = 100000
+# names left for SymSpell above which correct_names uses a process pool
+POOL_MIN = 200
+
+
+class Deletes(Mapping):
+    """
+    Read-only deletes index of a SymSpell (delete -> words) kept in the
+    snapshot database instead of a dict: opening it costs nothing, SQLite maps
+    the file, and worker processes share the same pages through the OS cache.
+    """
+
+    def __init__(self, file):
+        self.db = sqlite3.connect('file:%s?mode=ro' % Path(file).resolve().as_posix(), uri=True,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA mmap_size=268435456')
+        self.lock = threading.Lock()
+        self.last = (None, None)
+
+    def get(self, key, default=None):
+        # lookup asks `key in deletes` and then deletes[key]: the second one is a hit here
+        last = self.last
+        if last[0] == key:
+            return last[1] if last[1] is not None else default
+        with self.lock:
+            row = self.db.execute('SELECT words FROM deletes WHERE key = ?', (key,)).fetchone()
+        value = row[0].split('\n') if row else None
+        self.last = (key, value)
+        return value if value is not None else default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT count(*) FROM deletes').fetchone()[0]
+
+    def __iter__(self):
+        with self.lock:
+            keys = [x for x, in self.db.execute('SELECT key FROM deletes')]
+        return iter(keys)
+
+
+def digest(dictionary):
+    return hashlib.sha256(Path(dictionary).read_bytes()).hexdigest()
+
+
+def save_snapshot(sym_spell, file, version):
+    temp = Path('%s.%s.tmp' % (file, os.getpid()))
+    db = sqlite3.connect(str(temp))
+    db.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value)')
+    db.execute('CREATE TABLE words (term TEXT PRIMARY KEY, count INTEGER) WITHOUT ROWID')
+    db.execute('CREATE TABLE deletes (key PRIMARY KEY, words TEXT) WITHOUT ROWID')
+    db.executemany('INSERT INTO meta VALUES (?, ?)', [('version', version), ('max_length', sym_spell._max_length)])
+    db.executemany('INSERT INTO words VALUES (?, ?)', sym_spell._words.items())
+    db.executemany('INSERT INTO deletes VALUES (?, ?)', ((k, '\n'.join(v)) for k, v in sym_spell._deletes.items() if v))
+    db.commit()
+    db.close()
+    os.replace(str(temp), str(file))
+
+
+def load_snapshot(file, version):
+    """
+    SymSpell whose words come from the snapshot and whose deletes stay in it,
+    or None when there is no snapshot of this version of the dictionary.
+    """
+    try:
+        db = sqlite3.connect('file:%s?mode=ro' % Path(file).resolve().as_posix(), uri=True)
+        meta = dict(db.execute('SELECT key, value FROM meta'))
+        if meta.get('version') != version:
+            db.close()
+            return None
+        words = dict(db.execute('SELECT term, count FROM words'))
+        db.close()
+    except sqlite3.Error:
+        return None
+    sym_spell = SymSpell(max_dictionary_edit_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH)
+    sym_spell._words = words
+    sym_spell._deletes = Deletes(file)
+    sym_spell._max_length = meta['max_length']
+    return sym_spell
+
+
+def _lookup(dictionary, names):
+    # runs in the pool processes, each one loads the snapshot once
+    project = Project(dictionary)
+    return [project.lookup(x) for x in names]
+
+
 class Project:
     instance = None
+    lock = threading.Lock()
 
-    def __init__(self):
-        if not Project.instance:
-            Project.instance = Project._Project()
+    def __init__(self, dictionary=None):
+        with Project.lock:
+            if not Project.instance:
+                Project.instance = Project._Project(dictionary)
 
     def __getattr__(self, name):
         return getattr(self.instance, name)
 
     class _Project:
 
-        def __init__(self):
-            initial_capacity = 83000
-            max_edit_distance_dictionary = 2
-            prefix_length = 7
-            self.sym_spell = SymSpell(initial_capacity, max_edit_distance_dictionary,
-                                 prefix_length)
-
+        def __init__(self, dictionary=None):
+            self.memo = None
+            self.matcher = None
             # load dictionary
-            dictionary_path = Path('dict_final.txt')
+            dictionary_path = Path(dictionary or DICTIONARY)
+            if not dictionary_path.exists() and not dictionary:
+                dictionary_path = Path(__file__).parent / DICTIONARY
+            self.dictionary = dictionary_path
+            if not dictionary_path.exists():
+                print("Dictionary file not found")
+                self.sym_spell = SymSpell(max_dictionary_edit_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH)
+                return
+
+            # the deletes index takes seconds to build from the text file, so it is
+            # built once per version of the dictionary and kept next to it
+            version = '%s %s %s' % (digest(dictionary_path), MAX_EDIT_DISTANCE, PREFIX_LENGTH)
+            snapshot = dictionary_path.with_suffix('.db')
+            # with a species list, the genus and then the epithet are matched against it
+            species = dictionary_path.with_name(SPECIES)
+            if species.exists():
+                self.matcher = Matcher.load(species)
+            # one table per version: a new dictionary or species list starts with an empty memo
+            memo = hashlib.sha256((version + (digest(species) if self.matcher else '')).encode()).hexdigest()
+            self.memo = Store(dictionary_path.with_suffix('.corrections.db'), memo[:16])
+            self.memo.trim(MEMO_SIZE)
+            self.sym_spell = load_snapshot(snapshot, version)
+            if self.sym_spell:
+                return
 
+            self.sym_spell = SymSpell(max_dictionary_edit_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH)
             count_index = 1  # column of the term frequency in the dictionary text file
             term_index = 0  # column of the term in the dictionary text file
-            if not self.sym_spell.load_dictionary(dictionary_path, term_index, count_index):
+            if not self.sym_spell.load_dictionary(str(dictionary_path), term_index, count_index):
                 print("Dictionary file not found")
                 return
+            try:
+                save_snapshot(self.sym_spell, snapshot, version)
+            except (OSError, sqlite3.Error) as e:
+                print(e)
 
         def correct_name(self, query):
+            return self.correct_names([query])[0]
+
+        def correct_names(self, queries, processes=None):
+            """
+            Corrections of `queries`, in the same order. Each distinct name is
+            looked up once: names whose words are all in the dictionary are kept
+            as they are, the others come from the memo shared by every source, or
+            from SymSpell, over a process pool when more than POOL_MIN are left
+            (not in a frozen build).
+            Blank cells and anything that is not a str are given back unchanged.
+            """
+            queries = list(queries)
+            found = {}
+            memo = []
+            todo = []
+            for x in dict.fromkeys(x for x in queries if isinstance(x, str) and x.strip()):
+                words = x.split()
+                if all(w in self.sym_spell._words for w in words):
+                    found[x] = ' '.join(words)
+                elif self.memo is not None and x in self.memo:
+                    found[x] = self.memo.get(x)
+                    memo.append(x)
+                else:
+                    todo.append(x)
+            processes = processes or os.cpu_count() or 1
+            if getattr(sys, 'frozen', False):
+                # a child of a PyInstaller build would start the GUI again
+                processes = 1
+            if len(todo) > POOL_MIN and processes > 1:
+                size = -(-len(todo) // (4 * processes))
+                chunks = [todo[i:i + size] for i in range(0, len(todo), size)]
+                with ProcessPoolExecutor(processes) as pool:
+                    looked = [y for x in pool.map(_lookup, [self.dictionary] * len(chunks), chunks) for y in x]
+            else:
+                looked = [self.lookup(x) for x in todo]
+            found.update(zip(todo, looked))
+            if self.memo is not None:
+                # the hits are written again too, so trim() drops the least recently used
+                self.memo.put_many([(x, found[x]) for x in memo + todo])
+                if len(self.memo) > MEMO_SIZE + MEMO_SIZE // 10:
+                    self.memo.trim(MEMO_SIZE)
+            return [found.get(x, x) if isinstance(x, str) else x for x in queries]
+
+        def lookup(self, query):
+            if self.matcher:
+                x = self.matcher.match(query)
+                if x:
+                    return x
 
             input_term = (query)  # max edit distance per lookup (per single word, not per whole input string)
             max_edit_distance_lookup = 2
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import hashlib
+import inspect
+import json
+import os
+import time
+import zlib
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# longest wait of a thread for a request made on the loop, time queued behind the limit included
+WAIT = 600
+
+
+class CacheMiss(requests.RequestException):
+    pass
+
+
+class ResponseCache:
+    """
+    Raw responses on disk, addressed by the sha256 of method + url + body, each
+    one a zlib compressed file with the status, headers, time and body.
+
+    mode 'record' answers from the cache and stores what it has to fetch,
+    'replay' never touches the network (a miss raises CacheMiss) and
+    'refresh' always fetches and overwrites.
+    """
+
+    def __init__(self, folder, mode='record', max_age=None):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.max_age = max_age
+
+    def key(self, method, url, body=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return hashlib.sha256(method.encode() + b' ' + url.encode() + b'\n' + (body or b'')).hexdigest()
+
+    def file(self, key):
+        return self.folder / key[:2] / key
+
+    def get(self, method, url, body=None):
+        if self.mode == 'refresh':
+            return None
+        file = self.file(self.key(method, url, body))
+        try:
+            data = zlib.decompress(file.read_bytes())
+        except OSError:
+            return None
+        meta, content = data.split(b'\n', 1)
+        meta = json.loads(meta.decode('utf-8'))
+        if self.max_age is not None and self.mode != 'replay' and time.time() - meta['time'] > self.max_age:
+            return None
+        # the modification time is what evict() uses to find the least recently used
+        os.utime(file)
+        response = requests.Response()
+        response.status_code = meta['status']
+        response.reason = meta['reason']
+        response.url = meta['url']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response.encoding = meta['encoding']
+        response._content = content
+        return response
+
+    def put(self, method, url, body, response):
+        # only successful answers: a 404/403/429 recorded would be replayed forever
+        if not 200 <= response.status_code < 300:
+            return
+        file = self.file(self.key(method, url, body))
+        file.parent.mkdir(exist_ok=True)
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ('content-encoding', 'content-length')}
+        meta = {'url': response.url, 'status': response.status_code, 'reason': response.reason,
+                'headers': headers, 'encoding': response.encoding, 'time': time.time()}
+        temp = file.with_suffix('.%s.tmp' % os.getpid())
+        temp.write_bytes(zlib.compress(json.dumps(meta).encode('utf-8') + b'\n' + response.content))
+        os.replace(str(temp), str(file))
+
+    def miss(self, method, url):
+        raise CacheMiss('%s %s não está no cache' % (method, url))
+
+    def evict(self, max_bytes=None, max_age=None):
+        files = [(x.stat(), x) for x in self.folder.glob('*/*') if x.is_file()]
+        now = time.time()
+        if max_age is not None:
+            for stat, x in [y for y in files if now - y[0].st_mtime > max_age]:
+                x.unlink()
+            files = [y for y in files if now - y[0].st_mtime <= max_age]
+        if max_bytes is not None:
+            total = sum(stat.st_size for stat, _ in files)
+            for stat, x in sorted(files, key=lambda y: y[0].st_mtime):
+                if total <= max_bytes:
+                    break
+                x.unlink()
+                total -= stat.st_size
+
+
+class CachedSession(requests.Session):
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        response = self.cache.get(request.method, request.url, request.body)
+        if response is not None:
+            response.request = request
+            return response
+        if self.cache.mode == 'replay':
+            self.cache.miss(request.method, request.url)
+        response = super().send(request, **kwargs)
+        self.cache.put(request.method, request.url, request.body, response)
+        return response
+
+
+def make_session(workers=1, gzip=True, cache=None):
+    """
+    Session shared by all requests of one source client: connections are kept
+    alive and reused, with up to `workers` open connections per host. With a
+    ResponseCache the raw responses are recorded/replayed from disk.
+    """
+    session = CachedSession(cache) if cache else requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, workers))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Connection': 'keep-alive',
+                            'Accept-Encoding': 'gzip, deflate' if gzip else 'identity'})
+    return session
+
+
+class AsyncSession:
+    """
+    requests-like get/post made on an aiohttp session owned by an asyncio loop.
+    The source clients keep their blocking code and call it from worker
+    threads; the requests themselves run on the loop, at most `limit` at a time.
+    """
+
+    def __init__(self, http, loop, limit=1, cache=None):
+        self.http = http
+        self.loop = loop
+        self.semaphore = asyncio.Semaphore(limit)
+        self.headers = {}
+        self.cache = cache
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None, **kwargs):
+        if self.cache:
+            # same key as the CachedSession of the blocking clients
+            prepared = requests.Request(method, url, params=params, data=data).prepare()
+            response = self.cache.get(prepared.method, prepared.url, prepared.body)
+            if response is not None:
+                return response
+            if self.cache.mode == 'replay':
+                self.cache.miss(prepared.method, prepared.url)
+        request = self._request(method, url, params=params, data=data, headers=headers, timeout=timeout)
+        future = asyncio.run_coroutine_threadsafe(request, self.loop)
+        try:
+            # a loop that stops before running the request never completes it
+            response = future.result(WAIT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            if inspect.getcoroutinestate(request) == inspect.CORO_CREATED:
+                # never started: closed here, the loop will not do it
+                request.close()
+            raise requests.Timeout('%s %s: sem resposta do loop em %s s' % (method, url, WAIT))
+        if self.cache:
+            self.cache.put(prepared.method, prepared.url, prepared.body, response)
+        return response
+
+    async def _request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        async with self.semaphore:
+            try:
+                async with self.http.request(method, url, params=params, data=data,
+                                             headers=dict(self.headers, **(headers or {})),
+                                             timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                    body = await r.read()
+            except asyncio.TimeoutError as e:
+                raise requests.ReadTimeout(e)
+            except aiohttp.ClientError as e:
+                raise requests.ConnectionError(e)
+        response = requests.Response()
+        response.status_code = r.status
+        response.reason = r.reason
+        response.url = str(r.url)
+        response.headers = CaseInsensitiveDict(r.headers)
+        response.encoding = r.charset
+        response._content = body
+        return response
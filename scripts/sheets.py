@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming writers of the Planilhas. Rows are appended and go to disk as
+they come, so a sheet is not held in memory, and a sheet that reaches the
+row limit of its format goes on in a new one: 'Planilha 3', 'Planilha 3 (2)'...
+
+    book = open_book('Planilha 3.xlsx')
+    sheet = book.sheet('Planilha 3', ['Nome Entrada', 'Família'])
+    sheet.append(['Lemna gibba', 'Araceae'])
+    book.close()
+
+xlsx is written by XlsxWriter in constant_memory mode, or by openpyxl in
+write-only mode when XlsxWriter is not installed. xls (xlwt) is kept for
+the old files, it holds the whole book in memory. csv and parquet write one
+file per sheet, named after the sheet.
+"""
+import csv
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xlwt
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ('xlsx', 'xls', 'csv', 'parquet')
+# rows per sheet, header included
+MAX_ROWS = {'xlsx': 1048576, 'xls': 65536}
+# rows of a Parquet row group
+CHUNK_ROWS = 50000
+
+
+class Formula:
+    """
+    Formula of a cell, written as for xlwt (';' between the arguments).
+    '{row}' is replaced by the number of the row the cell ends up in.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def at(self, row):
+        return self.text.replace('{row}', str(row))
+
+
+def cell(x):
+    """Value as it is written: NaN and None are empty cells, lists are written as text."""
+    if x is None or isinstance(x, Formula):
+        return x
+    if isinstance(x, (list, tuple, set, dict)):
+        return str(x)
+    if isinstance(x, np.generic):
+        x = x.item()
+    try:
+        if pd.isna(x):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return x
+
+
+class Sheet:
+    """A sheet of a book. The rows go to the current part, a new one is opened when it is full."""
+    # the header is written as the first row of each part
+    header_row = True
+
+    def __init__(self, book, name, header=None, numeric=()):
+        self.book = book
+        self.name = name
+        self.header = list(header) if header else None
+        self.numeric = set(numeric)
+        self.rows = 0
+        self.part = 0
+        self.row = 0
+        self.new_part()
+
+    def new_part(self):
+        self.part += 1
+        self.row = 0
+        self.open(self.name if self.part == 1 else '%s (%s)' % (self.name, self.part))
+        if self.header and self.header_row:
+            self.write(self.header)
+            self.row += 1
+
+    def append(self, row):
+        if self.book.max_rows and self.row >= self.book.max_rows:
+            self.new_part()
+        self.write([cell(x) for x in row])
+        self.row += 1
+        self.rows += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def append_frame(self, frame):
+        """Appends the rows of a DataFrame in bulk (columns in the order of the header), NaN as empty cells."""
+        rows = frame.astype(object).where(frame.notna(), None).values.tolist()
+        while rows:
+            if self.book.max_rows and self.row >= self.book.max_rows:
+                self.new_part()
+            n = self.book.max_rows - self.row if self.book.max_rows else len(rows)
+            self.write_rows(rows[:n])
+            self.rows += len(rows[:n])
+            rows = rows[n:]
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+            self.row += 1
+
+    def open(self, name):
+        raise NotImplementedError
+
+    def write(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Book:
+    max_rows = None
+    sheet_class = Sheet
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.sheets = []
+        self.files = [self.path]
+
+    def sheet(self, name, header=None, numeric=()):
+        """New sheet; `numeric` columns are kept as numbers where the format has types (parquet)."""
+        x = self.sheet_class(self, name, header, numeric)
+        self.sheets.append(x)
+        return x
+
+    def close(self):
+        for x in self.sheets:
+            x.close()
+
+
+class XlsxWriterSheet(Sheet):
+
+    def open(self, name):
+        self.worksheet = self.book.workbook.add_worksheet(name)
+
+    def write(self, row):
+        for j, x in enumerate(row):
+            if isinstance(x, Formula):
+                self.worksheet.write_formula(self.row, j, '=' + x.at(self.row + 1).replace(';', ','))
+            elif x is not None:
+                self.worksheet.write(self.row, j, x)
+
+
+class XlsxWriterBook(Book):
+    max_rows = MAX_ROWS['xlsx']
+    sheet_class = XlsxWriterSheet
+
+    def __init__(self, path):
+        super().__init__(path)
+        # constant_memory: each row is flushed to a temporary file once the next one starts
+        self.workbook = xlsxwriter.Workbook(str(self.path), {'constant_memory': True, 'strings_to_formulas': False,
+                                                             'strings_to_urls': False, 'strings_to_numbers': False})
+
+    def close(self):
+        super().close()
+        self.workbook.close()
+
+
+class OpenpyxlSheet(Sheet):
+
+    def open(self, name):
+        self.worksheet = self.book.workbook.create_sheet(name)
+
+    def write(self, row):
+        self.worksheet.append(['=' + x.at(self.row + 1).replace(';', ',') if isinstance(x, Formula) else x
+                               for x in row])
+
+
+class OpenpyxlBook(Book):
+    max_rows = MAX_ROWS['xlsx']
+    sheet_class = OpenpyxlSheet
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.workbook = openpyxl.Workbook(write_only=True)
+
+    def close(self):
+        super().close()
+        self.workbook.save(str(self.path))
+
+
+class XlsSheet(Sheet):
+
+    def open(self, name):
+        self.worksheet = self.book.workbook.add_sheet(name)
+
+    def write(self, row):
+        for j, x in enumerate(row):
+            if isinstance(x, Formula):
+                self.worksheet.write(self.row, j, xlwt.Formula(x.at(self.row + 1)))
+            elif x is not None:
+                self.worksheet.write(self.row, j, x)
+
+
+class XlsBook(Book):
+    max_rows = MAX_ROWS['xls']
+    sheet_class = XlsSheet
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.workbook = xlwt.Workbook()
+
+    def close(self):
+        super().close()
+        self.workbook.save(str(self.path))
+
+
+class CsvSheet(Sheet):
+
+    def open(self, name):
+        self.file = self.book.file(name).open('w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+
+    def write(self, row):
+        self.writer.writerow(['=' + x.at(self.row + 1).replace(';', ',') if isinstance(x, Formula) else x
+                              for x in row])
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        self.row += len(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class CsvBook(Book):
+    sheet_class = CsvSheet
+    suffix = '.csv'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.files = []
+
+    def file(self, name):
+        x = self.path.with_name(name + self.suffix)
+        self.files.append(x)
+        return x
+
+
+class ParquetSheet(Sheet):
+    # the header is the schema
+    header_row = False
+
+    def open(self, name):
+        if not self.header:
+            raise ValueError('%s: parquet needs a header' % name)
+        self.schema = pa.schema([(x, pa.float64() if x in self.numeric else pa.string()) for x in self.header])
+        self.writer = pq.ParquetWriter(str(self.book.file(name)), self.schema)
+        self.buffer = []
+
+    def write(self, row):
+        self.buffer.append([None if isinstance(x, Formula) else x for x in row])
+        if len(self.buffer) >= CHUNK_ROWS:
+            self.flush()
+
+    def write_rows(self, rows):
+        self.buffer.extend(rows)
+        self.row += len(rows)
+        if len(self.buffer) >= CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        frame = pd.DataFrame(self.buffer, columns=self.header)
+        for x in self.header:
+            if x in self.numeric:
+                frame[x] = pd.to_numeric(frame[x], errors='coerce')
+            else:
+                frame[x] = frame[x].map(lambda y: None if y is None else str(y))
+        self.writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ParquetBook(CsvBook):
+    sheet_class = ParquetSheet
+    suffix = '.parquet'
+
+
+def book_class(path, format=None):
+    """
+    Book class for `path`, in `format` (by default, the extension of path).
+    Raises ImportError/ValueError without creating anything, so a run can check
+    its Planilhas before it starts.
+    """
+    format = format or Path(path).suffix.lstrip('.').lower()
+    if format == 'xlsx':
+        if xlsxwriter:
+            return XlsxWriterBook
+        if openpyxl:
+            return OpenpyxlBook
+        raise ImportError('xlsx: instale o XlsxWriter ou o openpyxl')
+    if format == 'xls':
+        return XlsBook
+    if format == 'csv':
+        return CsvBook
+    if format == 'parquet':
+        if pa is None:
+            raise ImportError('parquet: instale o pyarrow')
+        return ParquetBook
+    raise ValueError('formato desconhecido: %s' % format)
+
+
+def open_book(path, format=None):
+    """Book for `path`, in `format` (by default, the extension of path)."""
+    return book_class(path, format)(path)
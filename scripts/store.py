@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import names
+
+# how long a "not found" is trusted before the name is searched again
+NEGATIVE_TTL = 30 * 24 * 3600
+
+
+class Store:
+    """
+    Persistent key/value table. Everything is loaded into memory once, so
+    lookups are plain dict hits, and every change is written through to SQLite.
+    """
+
+    def __init__(self, file, table='store'):
+        self.location = Path(file)
+        self.table = table
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.location), timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS "%s" (key TEXT PRIMARY KEY, value TEXT, time REAL)' % table)
+        self.db.commit()
+        self.data = {}
+        for key, value, t in self.db.execute('SELECT key, value, time FROM "%s"' % table):
+            self.data[key] = (json.loads(value), t)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def keys(self):
+        return list(self.data.keys())
+
+    def get(self, key, default=None, ttl=None):
+        item = self.data.get(key)
+        if item is None:
+            return default
+        if ttl is not None and time.time() - item[1] > ttl:
+            return default
+        return item[0]
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        with self.lock:
+            for key, value in items:
+                self.data[key] = (value, now)
+                rows.append((key, json.dumps(value), now))
+            self.db.executemany('INSERT OR REPLACE INTO "%s" (key, value, time) VALUES (?, ?, ?)' % self.table, rows)
+            self.db.commit()
+
+    def trim(self, size):
+        """Keeps only the `size` most recently written keys."""
+        if len(self.data) <= size:
+            return
+        with self.lock:
+            old = sorted(self.data, key=lambda key: self.data[key][1])[:len(self.data) - size]
+            for key in old:
+                del self.data[key]
+            self.db.executemany('DELETE FROM "%s" WHERE key = ?' % self.table, [(key,) for key in old])
+            self.db.commit()
+
+    def remove(self, key):
+        if key not in self.data:
+            return
+        with self.lock:
+            self.data.pop(key, None)
+            self.db.execute('DELETE FROM "%s" WHERE key = ?' % self.table, (key,))
+            self.db.commit()
+
+
+class Index(Store):
+    """
+    Name -> result file map for the folder of one source. Replaces the
+    recursive `glob('**/*name.csv')` done on every lookup, and only matches
+    the exact name (no more "Lemna gibba" matching "Xlemna gibba.csv").
+    Names are kept by `key` (names.key by default, so 'Lemna gibba L.' and
+    'lemna  gibba' are the same entry; names.author_key keeps the author).
+    """
+
+    def __init__(self, folder, pattern='*.csv', key=names.key):
+        self.folder = Path(folder)
+        self.normalize = key
+        super().__init__(self.folder / 'index.db', 'files')
+        if not self.data:
+            self.scan(pattern)
+        else:
+            self.rekey()
+
+    def scan(self, pattern='*.csv'):
+        # walks the folder once, to pick up results saved before the index existed
+        self.put_many([(self.normalize(file.stem), file.relative_to(self.folder).as_posix())
+                       for file in self.folder.glob('**/' + pattern)])
+
+    def rekey(self):
+        # indexes written before the names were normalized: the raw names become keys
+        old = [x for x in self.data if self.normalize(x) != x]
+        if not old:
+            return
+        self.put_many([(self.normalize(x), self.data[x][0]) for x in old if self.normalize(x) not in self.data])
+        with self.lock:
+            for x in old:
+                del self.data[x]
+            self.db.executemany('DELETE FROM "%s" WHERE key = ?' % self.table, [(x,) for x in old])
+            self.db.commit()
+
+    def __contains__(self, name):
+        return self.normalize(name) in self.data
+
+    def get(self, name, default=None, ttl=None):
+        return super().get(self.normalize(name), default, ttl)
+
+    def remove(self, name):
+        super().remove(self.normalize(name))
+
+    def add(self, name, file):
+        self.put(self.normalize(name), Path(file).relative_to(self.folder).as_posix())
+
+    def file(self, name):
+        value = self.get(name)
+        if not value:
+            return None
+        file = self.folder / value
+        if not file.exists():
+            self.remove(name)
+            return None
+        return file
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import ast
+import csv
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from names import authorship, name_key, query_keys
+from store import Store
+
+
+def names(value):
+    """The list of names of a 'sinonimos' cell: a list, or its str() as saved in the result CSVs."""
+    if isinstance(value, (list, tuple)):
+        return [str(x).strip() for x in value if x and str(x).strip()]
+    if not isinstance(value, str) or not value.strip():
+        return []
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return []
+    return names(value) if isinstance(value, (list, tuple)) else []
+
+
+class Synonyms:
+    """
+    Synonym graph of one source (synonym -> accepted name, accepted name ->
+    synonyms), filled from every result written, so a name already seen as a
+    synonym is resolved without going to the site. Like Store, it is kept in
+    memory and every change is written through to SQLite. Names are matched
+    exactly and then without the authorship, when the name has none or the
+    same one as the synonym (a homonym of another author is another name).
+    """
+
+    def __init__(self, file, table='synonyms'):
+        self.location = Path(file)
+        self.table = table
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.location), timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS "%s" (synonym TEXT PRIMARY KEY, accepted TEXT, time REAL)' % table)
+        self.db.commit()
+        # exact key -> (synonym, accepted), canonical key -> [(synonym, accepted)], accepted key -> synonyms
+        self.edges = {}
+        self.canonical = {}
+        self.children = {}
+        self.accepted_canonical = set()
+        # 'scanned' once the results saved before the graph were read, synonyms or not
+        self.meta = Store(self.location, table + '_meta')
+        for synonym, accepted, _ in self.db.execute('SELECT synonym, accepted, time FROM "%s"' % table):
+            self._link(synonym, accepted)
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __contains__(self, name):
+        return self.accepted(name) is not None
+
+    def _link(self, synonym, accepted):
+        exact, canonical = query_keys(synonym)
+        self.edges[exact] = (synonym, accepted)
+        self.canonical.setdefault(canonical, []).append((synonym, accepted))
+        self.children.setdefault(name_key(accepted), {})[exact] = synonym
+        self.accepted_canonical.add(query_keys(accepted)[1])
+
+    def add(self, accepted, synonyms):
+        """Links each of `synonyms` to the accepted name."""
+        accepted = ' '.join(str(accepted).split()) if accepted else ''
+        if not accepted:
+            return
+        now = time.time()
+        rows = []
+        with self.lock:
+            for synonym in synonyms:
+                synonym = ' '.join(str(synonym).split())
+                if not synonym or name_key(synonym) == name_key(accepted):
+                    continue
+                self._link(synonym, accepted)
+                rows.append((synonym, accepted, now))
+            if rows:
+                self.db.executemany('INSERT OR REPLACE INTO "%s" (synonym, accepted, time) VALUES (?, ?, ?)'
+                                    % self.table, rows)
+                self.db.commit()
+
+    def add_record(self, record):
+        """
+        Edges of one result (a row of the Flora or PlantList CSVs): the
+        synonyms of an accepted name, or the accepted name of a synonym.
+        """
+        # the rows given to write() have a list with the value of each column
+        first = lambda x: x[0] if isinstance(x, list) and len(x) == 1 else x
+        name = first(record.get('scientificname'))
+        if not isinstance(name, str) or not name.strip():
+            return
+        accepted = first(record.get('acceptednameusage'))
+        if isinstance(accepted, str) and accepted.strip():
+            self.add(accepted, [name])
+        sinonimos = record.get('sinonimos')
+        if isinstance(sinonimos, list) and len(sinonimos) == 1 and isinstance(sinonimos[0], list):
+            sinonimos = sinonimos[0]
+        self.add(name, names(sinonimos))
+
+    def scan(self, index):
+        # reads the results saved before the graph existed, once: an empty graph
+        # is not read again on every start when none of them had synonyms
+        if len(self) or self.meta.get('scanned'):
+            return
+        for name in index.keys():
+            file = index.file(name)
+            if not file:
+                continue
+            try:
+                with file.open('r', encoding='utf-8', newline='') as f:
+                    for record in csv.DictReader(f):
+                        self.add_record(record)
+            except (OSError, csv.Error, UnicodeDecodeError) as e:
+                print(e)
+        self.meta.put('scanned', time.time())
+
+    def edge(self, name):
+        """(synonym, accepted) of a known synonym, or None."""
+        if not isinstance(name, str) or not name.strip():
+            return None
+        exact, canonical = query_keys(name)
+        if exact in self.edges:
+            return self.edges[exact]
+        # without the authorship only when no accepted name has the same canonical name
+        if canonical in self.accepted_canonical:
+            return None
+        author = authorship(name)
+        for synonym, accepted in self.canonical.get(canonical, []):
+            if not author or author == authorship(synonym):
+                return synonym, accepted
+        return None
+
+    def accepted(self, name):
+        """Accepted name of a known synonym, or None."""
+        x = self.edge(name)
+        return x[1] if x else None
+
+    def synonym(self, name):
+        """The name of the synonym as it was found (with its authorship), or None."""
+        x = self.edge(name)
+        return x[0] if x else None
+
+    def synonyms(self, accepted):
+        return list(self.children.get(name_key(accepted), {}).values())
+
+    def resolve(self, queries):
+        """Accepted names of a whole column of names (None for names that are not known synonyms)."""
+        return [self.accepted(x) for x in queries]
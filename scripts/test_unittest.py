@@ -1,12 +1,35 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from queue import Queue
+
+import requests
 
 from GBIF import *
 from FloraBrasil import *
 from ThePlantList import *
 from SpeciesLink import *
 
+from checklist import Checklist
+from engine import Engine
+from flight import InOrder, SingleFlight
+from macrofitas import Scheduler, parser
 from main import *
+from matcher import Matcher
+from occurrences import OccurrenceStore, write_csv
+import parsing
+import names
 from project import *
+import session
+from session import AsyncSession, CacheMiss, ResponseCache, make_session
+from sheets import Formula, open_book
+from store import Index, Store
+from synonyms import Synonyms
 
 
 class Testing(unittest.TestCase):
@@ -55,5 +78,560 @@ class Testing(unittest.TestCase):
         a.write(x, directory_path)
         self.assertTrue(os.path.exists(directory_path))
 
+    def test_index_exact_name(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            (folder / 'Xlemna gibba.csv').write_text('a\n1\n')
+            index = Index(folder)
+            self.assertNotIn('Lemna gibba', index)
+            self.assertIsNone(index.file('Lemna gibba'))
+            (folder / 'Lemna gibba.csv').write_text('a\n1\n')
+            index.add('Lemna gibba', folder / 'Lemna gibba.csv')
+            self.assertEqual(folder / 'Lemna gibba.csv', Index(folder).file('Lemna gibba'))
+            index.db.close()
+
+            # a result whose file was deleted is not skipped by run
+            gbif = GBIF(path=folder)
+            gbif.index.add('Lemna gibba', gbif.output / 'Lemna gibba.csv')
+            self.assertFalse(gbif._has('Lemna gibba'))
+            (gbif.output / 'Lemna gibba.csv').write_text('a\n1\n')
+            gbif.index.add('Lemna gibba', gbif.output / 'Lemna gibba.csv')
+            self.assertTrue(gbif._has('Lemna gibba'))
+            gbif.index.db.close()
+            gbif.negative.db.close()
+
+    def test_names(self):
+        self.assertEqual({'Lemna gibba'}, {names.key(x) for x in ['Lemna gibba L.', 'Lemna  gibba', 'lemna gibba']})
+        self.assertEqual('Nymphaea ampla subsp. pulchella', names.key('Nymphaea ampla ssp. pulchella DC.'))
+        self.assertEqual('Nymphaea ampla', names.species('Nymphaea ampla var. pulchella'))
+        # an epithet in capitals is still the epithet, an author is not
+        self.assertEqual(['Lemna gibba', 'Lemna minor', 'Lemna gibba', 'Lemna gibba'],
+                         [names.key(x) for x in ['Lemna Gibba', 'Lemna Minor', 'LEMNA GIBBA', 'Lemna gibba (L.) Hegelm.']])
+        self.assertEqual('Lemna minor', names.species('Lemna Minor L.'))
+        # hybrids keep the marker
+        self.assertEqual({'Nymphaea x thiona'}, {names.key(x) for x in ['Nymphaea x thiona', 'Nymphaea × thiona',
+                                                                        'Nymphaea ×thiona', 'Nymphaea X thiona Ward']})
+        self.assertEqual(('Nymphaea', 'x thiona', '', 'Ward'), names.split_name('Nymphaea × thiona Ward'))
+        # a name with more than the genus never gives the genus alone
+        self.assertEqual(['Justicia sp.', 'Justicia sp.', 'Justicia spp.', 'Lemna L.', 'Justicia'],
+                         [names.key(x) for x in ['Justicia sp.', 'Justicia sp', 'Justicia spp.', 'Lemna L.', 'Justicia']])
+        self.assertNotEqual(names.query_keys('Justicia sp.')[1], names.query_keys('Justicia')[1])
+        self.assertEqual(['Justicia sp.', 'Lemna L.', 'Justicia'],
+                         [names.species(x) for x in ['Justicia sp.', 'Lemna L.', 'Justicia']])
+        self.assertEqual([True, True, False, False],
+                         [names.genus_only(x) for x in ['Justicia sp.', 'Lemna L.', 'Justicia', 'Lemna gibba L.']])
+        with tempfile.TemporaryDirectory() as tmp:
+            splink = SpeciesLink(path=Path(tmp))
+            splink.page = None  # no request is made
+            for x in ('Justicia sp.', 'Lemna L.'):
+                splink.run(x)
+                self.assertIn(x, splink.negative)
+            self.assertNotIn('Justicia', splink.negative)
+            splink.index.db.close()
+            splink.negative.db.close()
+        with tempfile.TemporaryDirectory() as tmp:
+            index = Index(Path(tmp))
+            index.add('Lemna Gibba', Path(tmp) / 'Lemna gibba.csv')
+            self.assertNotIn('Lemna Minor', index)
+            self.assertNotIn('Lemna', index)
+            index.db.close()
+        # Flora and PlantList keep the author: a homonym of another author is another taxon
+        self.assertEqual('Hydrocotyle umbellata vell', names.author_key('Hydrocotyle  umbellata Vell'))
+        self.assertEqual(names.author_key('Lemna gibba L.'), names.author_key('lemna  gibba l'))
+        with tempfile.TemporaryDirectory() as tmp:
+            index = Index(Path(tmp), key=names.author_key)
+            index.add('Hydrocotyle umbellata Vell.', Path(tmp) / 'Hydrocotyle umbellata vell.csv')
+            self.assertIn('Hydrocotyle umbellata vell', index)
+            self.assertNotIn('Hydrocotyle umbellata L.', index)
+            self.assertNotIn('Hydrocotyle umbellata', index)
+            index.db.close()
+        self.assertNotIn('/', names.filename('Lemna/gibba x'))
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            (folder / 'Lemna gibba L..csv').write_text('a\n1\n')
+            index = Index(folder)
+            self.assertEqual(folder / 'Lemna gibba L..csv', index.file('lemna  gibba'))
+            index.db.close()
+
+    def test_store_ttl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = Store(Path(tmp) / 'index.db', 'negative')
+            store.put('Lemna gibba', {'corrected': 'lemna gibba'})
+            self.assertEqual({'corrected': 'lemna gibba'}, store.get('Lemna gibba', ttl=60))
+            self.assertIsNone(store.get('Lemna gibba', ttl=-1))
+            store.remove('Lemna gibba')
+            self.assertNotIn('Lemna gibba', Store(Path(tmp) / 'index.db', 'negative'))
+
+    def test_response_cache_replay(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            response = requests.Response()
+            response.status_code = 200
+            response.url = 'http://www.theplantlist.org/tpl1.1/search?q=Lemna+gibba'
+            response._content = b'<html></html>'
+            ResponseCache(tmp).put('GET', response.url, None, response)
+
+            session = make_session(cache=ResponseCache(tmp, 'replay'))
+            self.assertEqual('<html></html>', session.get(response.url).text)
+            self.assertRaises(CacheMiss, session.get, 'http://www.theplantlist.org/tpl1.1/search?q=Lemna')
+
+            for status in (404, 429, 503):
+                response.status_code = status
+                response.url = 'http://www.theplantlist.org/tpl1.1/search?q=%s' % status
+                ResponseCache(tmp).put('GET', response.url, None, response)
+                self.assertIsNone(ResponseCache(tmp).get('GET', response.url))
+
+    def test_http_error_not_cached(self):
+        class Down:
+            def get(self, url, **kwargs):
+                response = requests.Response()
+                response.status_code = 503
+                response.url = url
+                response._content = b'<html>Service Unavailable</html>'
+                return response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            gbif = GBIF(path=Path(tmp), session=Down())
+            self.assertRaises(RequestException, gbif.run, 'Lemna gibba')
+            self.assertNotIn('Lemna gibba', gbif.negative)
+            flora = FloraBrasil(path=Path(tmp), session=Down())
+            flora.run('Lemna gibba')
+            self.assertNotIn('Lemna gibba', flora.negative)
+            self.assertFalse(len(flora.prefixes))
+            plant = ThePlantList(path=Path(tmp), session=Down())
+            self.assertRaises(RequestException, plant.run, 'Lemna gibba')
+            self.assertNotIn('Lemna gibba', plant.negative)
+
+    def test_flora_auto_complete(self):
+        class AutoComplete:
+            catalog = ['Lemna gibba', 'Lemna minor', 'Lemna minuta']
+
+            def __init__(self):
+                self.calls = []
+
+            def get(self, url, **kwargs):
+                prefix = url.split('nomeCompleto=', 1)[1]
+                self.calls.append(prefix)
+                response = requests.Response()
+                response.status_code = 200
+                response._content = json.dumps([x for x in self.catalog if x.startswith(prefix)]).encode()
+                return response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            session = AutoComplete()
+            flora = FloraBrasil(path=Path(tmp), session=session)
+            # one hit at genus + epithet: a single request
+            self.assertEqual('Lemna gibba', flora.auto_complete('Lemna gibba L.'))
+            self.assertEqual(['Lemna gibba'], session.calls)
+            # several hits: the genus alone is not an answer
+            session.calls = []
+            self.assertIsNone(flora.auto_complete('Lemna'))
+            self.assertEqual(['Lemna'], session.calls)
+            # no hit for the name, the binary search finds the longest prefix with one
+            session.calls = []
+            self.assertEqual('Lemna minuta', flora.auto_complete('Lemna minutissima'))
+            self.assertEqual(['Lemna minutissima', 'Lemna mi', 'Lemna minuti', 'Lemna minu'], session.calls)
+            # no hit at all
+            session.calls = []
+            self.assertIsNone(flora.auto_complete('Xyz abc'))
+            self.assertEqual(['Xyz abc', 'Xyz', 'X'], session.calls)
+            # warm cache, also for the next run: no request
+            session.calls = []
+            for x in ('Lemna gibba L.', 'Lemna', 'Lemna minutissima', 'Xyz abc'):
+                flora.auto_complete(x)
+                FloraBrasil(path=Path(tmp), session=session).auto_complete(x)
+            self.assertEqual([], session.calls)
+
+    def test_flora_stages(self):
+        class Flora:
+            def __init__(self):
+                self.calls = {}
+
+            def get(self, url, **kwargs):
+                stage = next(x for x in ('AutoComplete', 'Consultar', 'CarregaTaxonGrupo', 'taxon/') if x in url)
+                self.calls[stage] = self.calls.get(stage, 0) + 1
+                if stage == 'AutoComplete':
+                    body = json.dumps([url.split('nomeCompleto=', 1)[1]])
+                elif stage == 'Consultar':
+                    # two synonyms, one idDadosListaBrasil
+                    body = '<input id="carregaTaxonGrupoIdDadosListaBrasil" value="3392">'
+                elif stage == 'CarregaTaxonGrupo':
+                    body = json.dumps({'nomeStr': 'Eichhornia crassipes (Mart.) Solms'})
+                else:
+                    body = json.dumps({'result': [{'scientificname': 'Eichhornia crassipes'}]})
+                response = requests.Response()
+                response.status_code = 200
+                response._content = body.encode()
+                return response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            session = Flora()
+            flora = FloraBrasil(path=Path(tmp), session=session)
+            for x in ('Eichhornia crassipes', 'Pontederia crassipes'):
+                self.assertEqual('Eichhornia crassipes (Mart.) Solms', flora.search(x)['nomeStr'])
+            self.assertEqual({'AutoComplete': 2, 'Consultar': 2, 'CarregaTaxonGrupo': 1, 'taxon/': 1}, session.calls)
+            # force goes past every memo, the prefixes too
+            session.calls = {}
+            flora.search('Eichhornia crassipes', force=True)
+            self.assertEqual({'AutoComplete': 1, 'Consultar': 1, 'CarregaTaxonGrupo': 1, 'taxon/': 1}, session.calls)
+
+    def test_splink_pages(self):
+        class Splink:
+            def __init__(self, total, missing=None, status=200):
+                self.total, self.missing, self.status, self.calls = total, missing, status, 0
+
+            def post(self, url, **kwargs):
+                self.calls += 1
+                offset = int(url.rsplit('=', 1)[1])
+                # the second page is the slowest, so the pages do not finish in order
+                time.sleep(0.05 if offset == 10 else 0)
+                records = '' if offset == self.missing else ''.join(
+                    '<tr class="record"><td><span onclick="showRecord(%d,1)">x</span></td><td><span>'
+                    '<span class="tGa">Lemna</span> <span class="lA">[lat: -23.%d</span></span></td></tr>' % (i, i)
+                    for i in range(offset, min(offset + 10, self.total)))
+                response = requests.Response()
+                response.status_code = self.status
+                response.url = url
+                response._content = ('<div id="div_hint_summary"><ll>%s</ll><ll>10</ll><ll>%s</ll></div>'
+                                     '<table><tr class="record"><td></td></tr>%s</table>'
+                                     % (offset, self.total, records)).encode()
+                return response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            splink = SpeciesLink(path=Path(tmp), session=Splink(45), fanout=3)
+            splink.run('Lemna gibba')
+            self.assertEqual([str(i) for i in range(45)], splink._get('Lemna gibba')['idx'].astype(str).tolist())
+
+            splink = SpeciesLink(path=Path(tmp), session=Splink(45, missing=20), fanout=3)
+            self.assertRaises(RequestException, splink.run, 'Lemna minor')
+            self.assertIsNone(splink._get('Lemna minor'))
+            self.assertEqual([], list(Path(tmp).glob('Splink/*.tmp')))
+
+            import SpeciesLink as module
+            backoff, module.BACKOFF = module.BACKOFF, 0
+            try:
+                splink = SpeciesLink(path=Path(tmp), session=Splink(45, status=503))
+                self.assertRaises(RequestException, splink.page, 'Lemna minor', 0)
+                self.assertEqual(module.RETRIES, splink.session.calls)
+            finally:
+                module.BACKOFF = backoff
+
+    def test_gbif_pages(self):
+        class Occurrences:
+            def get(self, url, params=None, **kwargs):
+                params = dict(params)
+                offset, limit = params['offset'], params['limit']
+                # the first page is the slowest, so the pages do not finish in order
+                time.sleep(0.05 if offset == 0 else 0)
+                response = requests.Response()
+                response.status_code = 200
+                response._content = json.dumps({'count': 1000, 'results': [
+                    {'recordedBy': 'Coletor %d' % i} for i in range(offset, offset + limit)]}).encode()
+                return response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            gbif = GBIF(path=Path(tmp), session=Occurrences(), fanout=4, max_records=700)
+            count = gbif.count(1)
+            self.assertEqual(700, count)
+            pages = list(gbif.pages({'usageKey': 1, 'scientificName': 'Lemna gibba'}, count, limit=100))
+            self.assertEqual(['Coletor %d' % i for i in range(700)], [x['recordedBy'] for page in pages for x in page])
+
+        args = parser().parse_args(['run', 'ListaMacrofita.xlsx', '--max-records', '500'])
+        self.assertEqual(500, args.max_records)
+        self.assertIsNone(parser().parse_args(['run', 'ListaMacrofita.xlsx']).max_records)
+
+    def test_loads_keep(self):
+        # orjson + _cut and json + object_pairs_hook give the same projection, keys in the same order
+        page = json.dumps({'offset': 0, 'count': 2, 'results': [
+            {'key': 1, 'species': 'Lemna gibba', 'decimalLatitude': -23.5, 'gadm': {'level0': {'gid': 'BRA'}},
+             'extensions': {}, 'country': 'Brazil', 'identifiers': [{'identifier': 'x'}], 'recordedBy': 'Pott'},
+            {'year': 2001, 'species': 'Lemna minor', 'media': [{'type': 'StillImage'}]}]}).encode()
+        fast = parsing.loads(page, PAGE)
+        with mock.patch.object(parsing, 'orjson', None):
+            slow = parsing.loads(page, PAGE)
+        self.assertEqual(slow, fast)
+        self.assertEqual([list(x) for x in slow['results']], [list(x) for x in fast['results']])
+        self.assertEqual(['species', 'decimalLatitude', 'country', 'recordedBy'], list(fast['results'][0]))
+
+    def test_scheduler_order(self):
+        class Sites:
+            species = ['Nome', 'Lemna gibba', 'Eichhornia crassipes', 'Justicia sp.']
+            queue_planilha_1 = Queue()
+
+            def __getitem__(self, x):
+                return getattr(self, x)
+
+            def do_work_flora(self, name):
+                # the first names are the slowest
+                time.sleep(0.02 * (len(self.species) - self.species.index(name)))
+
+            def do_work_plant(self, name):
+                pass
+
+        main = Sites()
+        Scheduler(main, workers=4).resolve()
+        self.assertEqual(main.species, [main.queue_planilha_1.get() for _ in main.species])
+
+        # the asyncio engine, without its aiohttp session
+        engine = Engine.__new__(Engine)
+        engine.main, engine.progress = main, {}
+        engine.order = InOrder(main.queue_planilha_1.put)
+
+        async def resolve():
+            engine.semaphores = {site: asyncio.Semaphore(4) for site in ('flora', 'plant')}
+            await asyncio.gather(*(engine.resolve(i, name) for i, name in enumerate(main.species)))
+
+        with ThreadPoolExecutor(8) as engine.pool:
+            asyncio.run(resolve())
+        self.assertEqual(main.species, [main.queue_planilha_1.get() for _ in main.species])
+
+    def test_async_session_stopped_loop(self):
+        # a request handed to a loop that no longer runs gives up instead of waiting forever
+        loop = asyncio.new_event_loop()
+        with mock.patch.object(session, 'WAIT', 0.1):
+            self.assertRaises(requests.Timeout, AsyncSession(None, loop).get, 'http://www.splink.org.br')
+        loop.close()
+
+    def test_scheduler_checks_first(self):
+        class Sites:
+            Planilha1 = Planilha2 = 'Planilha.ods'
+            Planilha3 = 'Planilha 3.csv'
+            queue_planilha_1 = Queue()
+
+        # refused before any Planilha thread is waiting on its queue
+        self.assertRaises(ValueError, Scheduler(Sites()).run)
+
+        # a Planilha that cannot open its file still takes its queue
+        queue = Queue()
+        for x in ('Lemna gibba', 'Lemna minor', None):
+            queue.put(x)
+        self.assertRaises(ValueError, Main.__new__(Main).book, 'Planilha.ods', queue)
+        queue.join()
+
+        # an input that does not exist stops the run before Main
+        args = parser().parse_args(['run', 'Não existe.xlsx'])
+        self.assertRaises(SystemExit, args.func, args)
+
+    def test_single_flight(self):
+        flight = SingleFlight()
+        calls = []
+        def fetch(query):
+            calls.append(query)
+            time.sleep(0.1)
+            return query.upper()
+        threads = [threading.Thread(target=flight.do, args=('Lemna gibba', fetch, 'Lemna gibba')) for _ in range(4)]
+        for x in threads:
+            x.start()
+        for x in threads:
+            x.join()
+        self.assertEqual('LEMNA GIBBA', flight.do('Lemna gibba', fetch, 'Lemna gibba'))
+        self.assertEqual(['Lemna gibba'], calls)
+        self.assertEqual(4, flight.saved)
+
+        # the waiters of a fetch that raises get its error, and nothing was saved
+        def down(query):
+            time.sleep(0.1)
+            raise RequestException(query)
+        errors = []
+        def do():
+            try:
+                flight.do('Lemna minor', down, 'Lemna minor')
+            except RequestException as e:
+                errors.append(e)
+        threads = [threading.Thread(target=do) for _ in range(3)]
+        for x in threads:
+            x.start()
+        for x in threads:
+            x.join()
+        self.assertEqual(3, len(errors))
+        self.assertEqual(4, flight.saved)
+
+    def test_single_flight_retry(self):
+        # a Flora name whose request failed is fetched again the next time it is queued
+        class Down:
+            def get(self, url, **kwargs):
+                response = requests.Response()
+                response.status_code = 503
+                response.url = url
+                response._content = b'<html>Service Unavailable</html>'
+                return response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            main = Main.__new__(Main)
+            main.flights = {'flora': SingleFlight()}
+            main.florabrasil = FloraBrasil(path=Path(tmp), session=Down())
+            calls = []
+            main.florabrasil.session.get = lambda url, **kwargs: calls.append(url) or Down().get(url)
+            main.do_work_flora('Lemna gibba')
+            main.do_work_flora('lemna  gibba')
+            self.assertEqual(2, len(calls))
+            self.assertEqual(0, main.flights['flora'].saved)
+
+    def test_dictionary_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dictionary = Path(tmp) / 'dict.txt'
+            dictionary.write_text('Lemna 10\ngibba 5\nminor 3\n')
+            first = Project._Project(dictionary)
+            self.assertTrue(dictionary.with_suffix('.db').exists())
+            second = Project._Project(dictionary)
+            self.assertIsInstance(second.sym_spell._deletes, Deletes)
+            self.assertEqual(first.correct_name('Lemna gibab'), second.correct_name('Lemna gibab'))
+            dictionary.write_text('Lemna 10\nminor 3\n')
+            self.assertNotIsInstance(Project._Project(dictionary).sym_spell._deletes, Deletes)
+
+    def test_correct_names(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dictionary = Path(tmp) / 'dict.txt'
+            dictionary.write_text('Lemna 10\ngibba 5\nminor 3\n')
+            project = Project._Project(dictionary)
+            self.assertEqual(['Lemna gibba', 'Lemna minor', 'Lemna gibba'],
+                             project.correct_names(['Lemna gibab', 'Lemna  minor', 'Lemna gibab']))
+            self.assertIn('Lemna gibab', project.memo)
+            self.assertNotIn('Lemna minor', project.memo)
+            # blank cells of the input sheet
+            x = project.correct_names([float('nan'), '  ', None, 'Lemna gibab'])
+            self.assertNotEqual(x[0], x[0])
+            self.assertEqual(['  ', None, 'Lemna gibba'], x[1:])
+
+    def test_matcher(self):
+        matcher = Matcher(['Eichhornia crassipes', 'Eichhornia azurea', 'Lemna gibba', 'Lemna minor'])
+        self.assertEqual('Eichhornia crassipes (Mart.) Solms', matcher.match('Eichornia crasipes (Mart.) Solms'))
+        self.assertEqual('Lemna minor var. x L.', matcher.match('lemna minr var. x L.'))
+        self.assertIsNone(matcher.match('Lemna crassipes'))
+
+    def test_checklist(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checklist = Checklist(Path(tmp) / 'checklist.db')
+            checklist.import_frames('plant', [pd.DataFrame({
+                'id': ['1', '2'], 'name': ['Eichhornia crassipes (Mart.) Solms', 'Pontederia crassipes Mart.'],
+                'canonical': ['eichhornia crassipes', 'pontederia crassipes'], 'authorship': ['(Mart.) Solms', 'Mart.'],
+                'genus': ['Eichhornia', 'Pontederia'], 'epithet': ['crassipes', 'crassipes'],
+                'status': ['Accepted', 'Synonym'], 'accepted_id': ['', '1']})])
+            x = checklist.resolve('plant', 'Pontederia  crassipes')
+            self.assertEqual('Eichhornia crassipes (Mart.) Solms', x['accepted']['name'])
+            self.assertEqual(['Pontederia crassipes Mart.'], checklist.resolve('plant', 'Eichhornia crassipes')['synonyms'])
+            self.assertIsNone(checklist.resolve('flora', 'Eichhornia crassipes'))
+            # another author is another name, left to the site
+            self.assertEqual('Pontederia crassipes Mart.',
+                             checklist.resolve('plant', 'Pontederia crassipes mart')['taxon']['name'])
+            self.assertIsNone(checklist.resolve('plant', 'Pontederia crassipes Roem. & Schult.'))
+            plant = ThePlantList(path=Path(tmp), checklist=checklist)
+            self.assertEqual(['synonym'], plant.local('Pontederia crassipes Mart.')['status'])
+
+    def test_synonyms(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            graph = Synonyms(Path(tmp) / 'index.db')
+            graph.add_record({'scientificname': ['Eichhornia crassipes (Mart.) Solms'], 'acceptednameusage': [None],
+                              'sinonimos': [['Pontederia crassipes Mart.']]})
+            graph.add_record({'scientificname': 'Lemna minuta Kunth', 'acceptednameusage': 'Lemna minor L.',
+                              'sinonimos': ''})
+            graph = Synonyms(Path(tmp) / 'index.db')
+            self.assertEqual(['Eichhornia crassipes (Mart.) Solms', 'Lemna minor L.', None, None],
+                             graph.resolve(['Pontederia  crassipes', 'Lemna minuta Kunth', 'Eichhornia crassipes',
+                                            'Lemna gibba']))
+            self.assertEqual(['Pontederia crassipes Mart.'], graph.synonyms('Eichhornia crassipes (Mart.) Solms'))
+            # a homonym of another author is not the synonym
+            graph.add('Hydrocotyle bonariensis Lam.', ['Hydrocotyle umbellata Vell.'])
+            self.assertIsNone(graph.accepted('Hydrocotyle umbellata L.'))
+            self.assertIsNone(graph.synonym('Hydrocotyle umbellata L.'))
+            self.assertEqual(['Hydrocotyle bonariensis Lam.'] * 2,
+                             graph.resolve(['Hydrocotyle umbellata', 'Hydrocotyle umbellata Vell']))
+            self.assertEqual('Hydrocotyle umbellata Vell.', graph.synonym('hydrocotyle  umbellata'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            (folder / 'Lemna gibba.csv').write_text('scientificname,acceptednameusage,sinonimos\nLemna gibba L.,,[]\n')
+            index = Index(folder)
+            Synonyms(folder / 'index.db').scan(index)
+            # no synonyms found, still not scanned again
+            (folder / 'Lemna gibba.csv').write_text('scientificname,acceptednameusage,sinonimos\n'
+                                                    'Lemna minuta Kunth,Lemna minor L.,[]\n')
+            graph = Synonyms(folder / 'index.db')
+            graph.scan(index)
+            self.assertEqual(0, len(graph))
+            index.db.close()
+
+    def test_sheets_rollover(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            book = open_book(Path(tmp) / 'Planilha 3.xlsx')
+            book.max_rows = 3
+            sheet = book.sheet('Planilha 3', ['Nome Entrada', 'Latitude', 'Flora x Plant'])
+            sheet.extend([['Lemna gibba', float('nan'), Formula('IF(A{row}="";"";"x")')]] * 5)
+            book.close()
+            x = pd.read_excel(Path(tmp) / 'Planilha 3.xlsx', sheet_name=None)
+            self.assertEqual(['Planilha 3', 'Planilha 3 (2)', 'Planilha 3 (3)'], list(x))
+            self.assertEqual([2, 2, 1], [len(y) for y in x.values()])
+
+            book = open_book(Path(tmp) / 'Planilha 3.csv')
+            book.sheet('Planilha 3', ['Nome Entrada']).append(['Lemna gibba'])
+            book.close()
+            self.assertEqual([Path(tmp) / 'Planilha 3.csv'], book.files)
+
+    def test_planilha_3(self):
+        x = pd.DataFrame({'tF': ['Araceae', None], 'tGa': ['Lemna', 'Lemna'], 'tEa': ['gibba', None],
+                          'lA': ['-23.5', '-1.2']})
+        rows = planilha_3('splink', 'Lemna gibba', x)
+        self.assertEqual(PLANILHA_3, rows.columns.tolist())
+        self.assertEqual(['Lemna gibba', 'Lemna'], rows['Espécie'].tolist())
+        self.assertEqual(['Lemna gibba'] * 2, rows['Nome Entrada'].tolist())
+        self.assertTrue(rows['Filo'].isna().all())
+
+    def test_write_csv_pages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file = Path(tmp) / 'Lemna gibba.csv'
+            # a column first seen on the second page goes to the end of the header
+            pages = [pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']}), pd.DataFrame({'b': ['z'], 'c': [3.5]})]
+            self.assertEqual(3, write_csv(iter(pages), file))
+            x = pd.read_csv(file)
+            self.assertEqual(['a', 'b', 'c'], x.columns.tolist())
+            self.assertEqual(['x', 'y', 'z'], x['b'].tolist())
+            self.assertTrue(x['c'][:2].isna().all())
+            self.assertEqual(3.5, x['c'][2])
+
+            # nothing found: no file
+            self.assertEqual(0, write_csv(iter([]), Path(tmp) / 'Lemna minor.csv'))
+            self.assertEqual(0, write_csv(iter([pd.DataFrame()]), Path(tmp) / 'Lemna minor.csv'))
+            self.assertFalse((Path(tmp) / 'Lemna minor.csv').exists())
+
+            # a page raises: the file written before is kept and no temporary file is left
+            def broken():
+                yield pd.DataFrame({'a': [9]})
+                raise RequestException('página')
+            self.assertRaises(RequestException, write_csv, broken(), file)
+            self.assertEqual(3, len(pd.read_csv(file)))
+            self.assertEqual([file], list(Path(tmp).iterdir()))
+
+    def test_occurrence_store_versions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = OccurrenceStore(Path(tmp), 'splink')
+            store.append('Lemna gibba', pd.DataFrame({'cL': ['a', 'b'], 'lA': ['-23.5', '-1.2 & ']}))
+            # read from the buffer, published only once it is on disk
+            self.assertIn('Lemna gibba', store)
+            self.assertNotIn('Lemna gibba', store.names)
+            self.assertEqual(['a', 'b'], store.read('Lemna gibba')['cL'].tolist())
+            store.flush()
+            self.assertIn('Lemna gibba', store.names)
+            time.sleep(0.01)
+            store.append('Lemna gibba', pd.DataFrame({'cL': ['c'], 'lA': ['-3']}))
+            for x in ('minor', 'minuta', 'trisulca', 'valdiviana'):
+                store.append('Lemna ' + x, pd.DataFrame({'cL': [x], 'lA': ['1']}))
+            store.flush()
+            # the species of a batch go to one file per genus
+            self.assertEqual(2, len(list((store.folder / 'genus=Lemna').glob('*.parquet'))))
+            for compacted in (False, True):
+                if compacted:
+                    store.compact()
+                    self.assertEqual(1, len(list((store.folder / 'genus=Lemna').glob('*.parquet'))))
+                x = store.read('Lemna gibba')
+                self.assertEqual(['c'], x['cL'].tolist())
+                self.assertEqual([-3.0], x['lA'].tolist())
+                self.assertEqual(['minor'], store.read('Lemna minor')['cL'].tolist())
+            store.append('Lemna gibba', pd.DataFrame({'cL': ['d'], 'lA': ['-4']}))
+            store.flush()
+            args = parser().parse_args(['compact', tmp])
+            args.func(args)
+            self.assertEqual(1, len(list((store.folder / 'genus=Lemna').glob('*.parquet'))))
+            self.assertEqual(['d'], OccurrenceStore(Path(tmp), 'splink').read('Lemna gibba')['cL'].tolist())
+
+
 if __name__ == '__main__':
     unittest.main()